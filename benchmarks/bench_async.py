@@ -0,0 +1,83 @@
+"""Load test of concurrent divinations through the async API.
+
+Sends bursts of CONCURRENCY divination requests arriving at the same time
+(each draws and saves the result) against a deck of CARDS cards, once calling
+the blocking Divination from the event loop and once through AsyncDivination.
+Reports the request latency, counted from the arrival of the burst, and how
+long the event loop was stalled (measured by a heartbeat task).
+
+Usage: python benchmarks/bench_async.py [cards] [requests]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+os.environ["DECK_BOX_HOME"] = tempfile.mkdtemp()
+
+from deck_box.aio import AsyncDivination, AsyncStorage
+from deck_box.divination import Divination
+from deck_box.models import Card, DivinationResult
+from deck_box.storage import Storage
+
+HEARTBEAT_SECONDS = 0.005
+
+async def heartbeat(lags):
+    """Record how late the event loop wakes up a sleeping task"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(HEARTBEAT_SECONDS)
+        lags.append(time.perf_counter() - start - HEARTBEAT_SECONDS)
+
+async def blocking_request():
+    """Handle a request with the blocking API, as a naive handler would"""
+    divination = Divination()
+    cards = divination.perform_divination()
+    divination.storage.save_divination(DivinationResult(cards))
+
+async def run(handler, requests, concurrency):
+    """Serve `requests` requests in bursts of `concurrency`, returning latencies and loop lags"""
+    latencies = []
+    lags = []
+
+    async def timed(arrival):
+        await handler()
+        latencies.append(time.perf_counter() - arrival)
+
+    beat = asyncio.ensure_future(heartbeat(lags))
+    await asyncio.sleep(0)
+    for _ in range(0, requests, concurrency):
+        arrival = time.perf_counter()
+        await asyncio.gather(*(timed(arrival) for _ in range(concurrency)))
+    await asyncio.sleep(HEARTBEAT_SECONDS * 2)
+    beat.cancel()
+    return latencies, lags
+
+async def main():
+    cards = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    Storage().save_cards(Card(f"任务{i}", 5 + i * 7 % 90, "bench") for i in range(cards))
+
+    async with await AsyncStorage.open() as storage:
+        divination = AsyncDivination(storage)
+
+        async def async_request():
+            cards = await divination.perform_divination()
+            await storage.save_divination(DivinationResult(cards))
+
+        print(f"{cards} cards, {requests} requests")
+        print(f"{'api':>8} {'concurrency':>12} {'p50 ms':>8} {'p95 ms':>8} {'max loop stall ms':>18}")
+        for concurrency in (1, 10, 50):
+            for name, handler in (("blocking", blocking_request), ("async", async_request)):
+                latencies, lags = await run(handler, requests, concurrency)
+                latencies.sort()
+                p50 = statistics.median(latencies) * 1000
+                p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+                print(f"{name:>8} {concurrency:>12} {p50:>8.1f} {p95:>8.1f} {max(lags) * 1000:>18.1f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
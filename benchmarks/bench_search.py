@@ -0,0 +1,47 @@
+"""Benchmark full-text search and ID prefix resolution on a large deck.
+
+Usage: python benchmarks/bench_search.py [deck size]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from deck_box.models import Card
+from deck_box.storage import Storage
+
+WORDS = ["整理", "项目", "文档", "会议", "周报", "代码", "测试", "设计", "学习", "阅读", "邮件", "review", "report", "deploy"]
+TAGS = ["work", "study", "home", "health"]
+QUERIES = ["项目文档", "会议", "report", "周报 work", "代码测试"]
+
+def timed(function, *args):
+    """Return the result of a call and its duration in milliseconds"""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as home:
+        os.environ["DECK_BOX_HOME"] = home
+        storage = Storage()
+        cards = [
+            Card("".join(rng.sample(WORDS, 3)), rng.randint(5, 90), rng.choice(TAGS))
+            for _ in range(size)
+        ]
+        storage.save_cards(cards)
+        
+        _, elapsed = timed(storage.search_cards, "预热")
+        print(f"index build ({size} cards): {elapsed:.0f} ms")
+        for query in QUERIES:
+            found, elapsed = timed(storage.search_cards, query)
+            print(f"search {query!r}: {len(found)} cards in {elapsed:.1f} ms")
+        _, elapsed = timed(storage.resolve_card_id, cards[size // 2].id[:6])
+        print(f"resolve ID prefix: {elapsed:.1f} ms")
+
+if __name__ == "__main__":
+    main()
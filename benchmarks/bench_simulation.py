@@ -0,0 +1,30 @@
+"""Benchmark how the simulation scales with the number of worker processes.
+
+Usage: python benchmarks/bench_simulation.py [runs]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from deck_box.models import Card
+from deck_box.simulation import simulate
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    cards = [Card(f"任务{i}", 5 + i * 7 % 90, "bench") for i in range(200)]
+    cpus = os.cpu_count() or 1
+    
+    baseline = None
+    print(f"{'workers':>8} {'seconds':>8} {'speedup':>8}")
+    for workers in sorted({1, 2, 4, cpus}):
+        start = time.perf_counter()
+        for _ in simulate(cards, runs, workers, seed=1):
+            pass
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>8.2f} {baseline / elapsed:>8.2f}")
+
+if __name__ == "__main__":
+    main()
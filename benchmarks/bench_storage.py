@@ -0,0 +1,62 @@
+"""Benchmark completing a card on decks of different sizes.
+
+Compares the keyed update path (point read + journal append) with the old
+approach of reloading and rewriting the whole deck. The keyed path should
+stay roughly flat as the deck grows.
+
+Usage: python benchmarks/bench_storage.py [deck sizes...]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from deck_box.models import Card, Mood, Quality
+from deck_box.storage import Storage
+
+OPERATIONS = 50
+
+def complete_keyed(storage, card_id):
+    """Complete a card through the keyed update API"""
+    card = storage.get_card_by_id(card_id)
+    card.complete(Mood.GOOD, 10, Quality.GOOD)
+    storage.update_card(card)
+
+def complete_full_rewrite(storage, card_id):
+    """Complete a card by reloading and rewriting the whole deck"""
+    cards = storage.load_cards()
+    for card in cards:
+        if card.id == card_id:
+            card.complete(Mood.GOOD, 10, Quality.GOOD)
+            break
+    storage.save_cards(cards)
+
+def bench(size, complete):
+    """Return the average time in milliseconds of one completion"""
+    with tempfile.TemporaryDirectory() as home:
+        os.environ["DECK_BOX_HOME"] = home
+        storage = Storage()
+        cards = [Card(f"任务{i}", 5 + i % 90, "bench") for i in range(size)]
+        storage.save_cards(cards)
+        # Warm up the index
+        storage.get_card_by_id(cards[0].id)
+        
+        step = max(1, size // OPERATIONS)
+        card_ids = [cards[i * step % size].id for i in range(OPERATIONS)]
+        start = time.perf_counter()
+        for card_id in card_ids:
+            complete(storage, card_id)
+        return (time.perf_counter() - start) / OPERATIONS * 1000
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 100000]
+    print(f"{'cards':>8} {'keyed (ms)':>12} {'full rewrite (ms)':>18}")
+    for size in sizes:
+        keyed = bench(size, complete_keyed)
+        full = bench(size, complete_full_rewrite) if size <= 10000 else float("nan")
+        print(f"{size:>8} {keyed:>12.3f} {full:>18.3f}")
+
+if __name__ == "__main__":
+    main()
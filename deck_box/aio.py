@@ -0,0 +1,220 @@
+import asyncio
+import contextlib
+import functools
+from .divination import AvailabilityIndex, CardSampler, ReadyQueue
+from .storage import DEFAULT_DECK, Storage
+
+class ReadWriteLock:
+    """Asyncio lock letting in any number of readers at once, or a single writer
+
+    Waiting writers go first, so a steady stream of reads cannot hold off a
+    write forever.
+    """
+    def __init__(self):
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+        self._changed = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def reading(self):
+        """Hold the lock as a reader"""
+        async with self._changed:
+            await self._changed.wait_for(lambda: not self._writing and not self._waiting_writers)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self._readers -= 1
+                self._changed.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def writing(self):
+        """Hold the lock as the only writer"""
+        async with self._changed:
+            self._waiting_writers += 1
+            try:
+                await self._changed.wait_for(lambda: not self._writing and not self._readers)
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self._writing = False
+                self._changed.notify_all()
+
+class AsyncStorage:
+    """Asyncio facade over Storage, keeping file I/O and parsing off the event loop
+
+    Reads and writes run in `executor` (the loop's default thread pool if
+    None). Concurrent loads of the same version of the deck share a single
+    load, so the cards they return are shared too and must not be changed in
+    place. Writes are queued and performed one at a time, in order, by a
+    single writer task; reads wait while a write is running so they never see
+    a half-written deck, but run concurrently with each other. A read finding
+    the index stale rebuilds it, which Storage serializes between threads.
+    """
+    def __init__(self, storage, executor=None):
+        self.storage = storage
+        self.executor = executor
+        self._loads = {}
+        self._io_lock = ReadWriteLock()
+        self._writes = None
+        self._writer = None
+
+    @classmethod
+    async def open(cls, deck=DEFAULT_DECK, executor=None):
+        """Open a deck without blocking the event loop (opening may upgrade its data files)"""
+        storage = await asyncio.get_running_loop().run_in_executor(executor, Storage, deck)
+        return cls(storage, executor)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def load_cards(self):
+        """Load all cards, sharing the load with concurrent callers reading the same version"""
+        signature = await self._run(self.storage.signature)
+        load = self._loads.get(signature)
+        if load is None:
+            load = asyncio.ensure_future(self._read(self.storage.load_cards))
+            self._loads[signature] = load
+            load.add_done_callback(lambda _: self._loads.pop(signature, None))
+        return list(await asyncio.shield(load))
+
+    async def get_card_by_id(self, card_id):
+        """Get card by ID"""
+        return await self._read(self.storage.get_card_by_id, card_id)
+
+    async def get_cards_by_ids(self, card_ids):
+        """Get the cards with the given IDs, skipping unknown IDs"""
+        return await self._read(self.storage.get_cards_by_ids, list(card_ids))
+
+    async def resolve_card_id(self, prefix, limit=2):
+        """Get the IDs of the cards whose ID starts with `prefix` (at most `limit` of them)"""
+        return await self._read(self.storage.resolve_card_id, prefix, limit)
+
+    async def search_cards(self, query, limit=20):
+        """Find the cards whose name, description or tag match every term of the query"""
+        return await self._read(self.storage.search_cards, query, limit)
+
+    async def load_divinations(self):
+        """Load all divination results"""
+        return await self._read(self.storage.load_divinations)
+
+    async def add_card(self, card):
+        """Add a new card"""
+        return await self._write(self.storage.add_card, card)
+
+    async def update_card(self, card):
+        """Update card information"""
+        return await self._write(self.storage.update_card, card)
+
+    async def delete_card(self, card_id):
+        """Delete card by ID"""
+        return await self._write(self.storage.delete_card, card_id)
+
+    async def save_divination(self, divination, card_decks=None):
+        """Save divination result"""
+        return await self._write(self.storage.save_divination, divination, card_decks)
+
+    async def materialize_templates(self):
+        """Create the cards of the current occurrence of every template, returning the new cards
+
+        Checking whether there is anything to create is only a read, so draws
+        that find nothing to do do not queue up behind each other as writes.
+        """
+        if not await self._read(self.storage.has_due_templates):
+            return []
+        return await self._write(self.storage.materialize_templates)
+
+    async def compact(self):
+        """Fold the journal into the cards file, archive old completed cards and rebuild the index"""
+        return await self._write(self.storage.compact)
+
+    async def close(self):
+        """Finish all queued writes and stop the writer task"""
+        if self._writer is None:
+            return
+        await self._writes.put(None)
+        await self._writer
+        self._writer = None
+
+    async def _run(self, function, *args):
+        """Run a blocking function in the executor"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(function, *args))
+
+    async def _read(self, function, *args):
+        """Run a read in the executor once no write is running"""
+        async with self._io_lock.reading():
+            return await self._run(function, *args)
+
+    async def _write(self, function, *args):
+        """Queue a write for the writer task and wait until it is done"""
+        if self._writer is None:
+            self._writes = asyncio.Queue()
+            self._writer = asyncio.ensure_future(self._write_loop())
+        done = asyncio.get_running_loop().create_future()
+        await self._writes.put((function, args, done))
+        return await done
+
+    async def _write_loop(self):
+        """Perform queued writes in order"""
+        while True:
+            task = await self._writes.get()
+            if task is None:
+                return
+            function, args, done = task
+            try:
+                async with self._io_lock.writing():
+                    result = await self._run(function, *args)
+            except Exception as e:
+                if not done.cancelled():
+                    done.set_exception(e)
+            else:
+                if not done.cancelled():
+                    done.set_result(result)
+
+class AsyncDivination:
+    """Asyncio counterpart of Divination, drawing from a single deck
+
+    Building the availability index and drawing run in the storage's executor
+    like everything else that takes time on a large deck.
+    """
+    def __init__(self, storage, level_weights=None, rng=None):
+        self.storage = storage
+        self.sampler = CardSampler(level_weights, rng)
+
+    async def available_cards(self):
+        """Get all available cards (pending and predecessors completed)"""
+        await self.storage.materialize_templates()
+        cards = await self.storage.load_cards()
+        return await self.storage._run(
+            lambda: AvailabilityIndex(cards, self.storage.storage.is_archived).available_cards()
+        )
+
+    async def perform_divination(self, min_time=90, max_time=150):
+        """Perform divination to draw a combination of cards within specified time range"""
+        available_cards = await self.available_cards()
+        return await self.storage._run(self.sampler.draw_combination, available_cards, min_time, max_time)
+
+    async def perform_constrained_divination(self, constraints, min_time=90, max_time=150):
+        """Perform divination to draw a combination of cards within specified time range satisfying the constraints"""
+        available_cards = await self.available_cards()
+        return await self.storage._run(self.sampler.draw_constrained, available_cards, min_time, max_time, constraints)
+
+    async def perform_urgent_divination(self, min_time=90, max_time=150, max_cards=5):
+        """Draw the most urgent cards (by due date, priority and level weight) within specified time range"""
+        available_cards = await self.available_cards()
+        return await self.storage._run(
+            lambda: ReadyQueue(available_cards, self.sampler.level_weights).draw(min_time, max_time, max_cards)
+        )
+
+    async def draw_single_card(self):
+        """Draw a single card"""
+        return self.sampler.select_card(await self.available_cards())
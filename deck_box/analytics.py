@@ -0,0 +1,173 @@
+import json
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime, timedelta
+
+# Draws not followed by a completion of the card within this many days count
+# as abandoned
+ABANDON_AFTER_DAYS = 7
+
+# Upper bounds (in hours) of the time-to-complete histogram buckets; slower
+# completions go into the last bucket
+TIME_BUCKETS = (1, 4, 24, 72, 168)
+
+def draw_events(divination):
+    """Get the events recording the cards of a divination result"""
+    return [
+        {"type": "draw", "at": divination.created_at.isoformat(), "card_id": card.id, "level": card.level, "tag": card.tag}
+        for card in divination.cards
+    ]
+
+def completion_event(card):
+    """Get the event recording the completion of a card"""
+    return {"type": "complete", "at": card.completed_at.isoformat(), "card_id": card.id}
+
+def time_bucket(hours):
+    """Get the histogram bucket (its upper bound in hours) of a time to complete"""
+    for bound in TIME_BUCKETS:
+        if hours <= bound:
+            return bound
+    return TIME_BUCKETS[-1] + 1
+
+class Rollup:
+    """Conversion counters of a group of draws (a level or a tag)"""
+    def __init__(self):
+        self.draws = 0
+        self.completed = 0
+        self.abandoned = 0
+        self.total_hours = 0.0
+        self.time_buckets = Counter()
+
+    @property
+    def conversion_rate(self):
+        """Share of the resolved draws (completed or abandoned) that were completed"""
+        resolved = self.completed + self.abandoned
+        return self.completed / resolved if resolved else None
+
+    @property
+    def mean_hours(self):
+        """Mean time from drawing to completing a card, in hours"""
+        return self.total_hours / self.completed if self.completed else None
+
+    def add_completion(self, hours):
+        """Record a draw that was completed after `hours`"""
+        self.completed += 1
+        self.total_hours += hours
+        self.time_buckets[time_bucket(hours)] += 1
+
+    def to_dict(self):
+        """Convert to dictionary format for storage"""
+        return {
+            "draws": self.draws,
+            "completed": self.completed,
+            "abandoned": self.abandoned,
+            "total_hours": self.total_hours,
+            "time_buckets": {str(bound): count for bound, count in self.time_buckets.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a Rollup instance from a dictionary"""
+        rollup = cls()
+        rollup.draws = data["draws"]
+        rollup.completed = data["completed"]
+        rollup.abandoned = data["abandoned"]
+        rollup.total_hours = data["total_hours"]
+        rollup.time_buckets = Counter({int(bound): count for bound, count in data["time_buckets"].items()})
+        return rollup
+
+class HistoryAnalytics:
+    """Streaming join of draw events with completion events by card ID
+
+    Events are consumed in the order they were logged. A draw stays open until
+    its card is completed, drawn again or the window passes, and is then
+    counted in the rollups of its level and tag. Only the draws of the current
+    window are held in memory, so the state stays small however long the
+    history is, and it can be saved and resumed from the last event read.
+    """
+    def __init__(self, window_days=ABANDON_AFTER_DAYS):
+        self.window_days = window_days
+        self.window = timedelta(days=window_days)
+        # card ID -> (draw time, level, tag), oldest draw first
+        self.open_draws = OrderedDict()
+        self.levels = defaultdict(Rollup)
+        self.tags = defaultdict(Rollup)
+        self.offset = 0
+
+    def update(self, events_file):
+        """Consume the events logged since the last update"""
+        if not events_file.exists():
+            return
+        with open(events_file, "rb") as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # An append still in progress; it is read next time
+                    break
+                self.offset += len(line)
+                try:
+                    self.process(json.loads(line))
+                except (json.JSONDecodeError, KeyError):
+                    continue
+
+    def process(self, event):
+        """Consume a single event"""
+        at = datetime.fromisoformat(event["at"])
+        self.expire(at)
+        card_id = event["card_id"]
+        if event["type"] == "draw":
+            if card_id in self.open_draws:
+                # Drawn again without being completed
+                self._resolve(card_id, None)
+            level, tag = event["level"], event["tag"] or ""
+            self.levels[level].draws += 1
+            self.tags[tag].draws += 1
+            self.open_draws[card_id] = (at, level, tag)
+        elif event["type"] == "complete" and card_id in self.open_draws:
+            self._resolve(card_id, at)
+
+    def expire(self, now):
+        """Count the draws older than the window as abandoned"""
+        cutoff = now - self.window
+        while self.open_draws:
+            card_id, (drawn_at, _, _) = next(iter(self.open_draws.items()))
+            if drawn_at > cutoff:
+                break
+            self._resolve(card_id, None)
+
+    def open_counts(self):
+        """Count the draws that are still open, by level and by tag"""
+        levels = Counter(level for _, level, _ in self.open_draws.values())
+        tags = Counter(tag for _, _, tag in self.open_draws.values())
+        return levels, tags
+
+    def _resolve(self, card_id, completed_at):
+        """Close an open draw as completed at `completed_at`, or as abandoned if that is None"""
+        drawn_at, level, tag = self.open_draws.pop(card_id)
+        for rollup in (self.levels[level], self.tags[tag]):
+            if completed_at is None:
+                rollup.abandoned += 1
+            else:
+                rollup.add_completion(max((completed_at - drawn_at).total_seconds(), 0) / 3600)
+
+    def to_dict(self):
+        """Convert to dictionary format for storage"""
+        return {
+            "window_days": self.window_days,
+            "offset": self.offset,
+            "open_draws": [[card_id, at.isoformat(), level, tag] for card_id, (at, level, tag) in self.open_draws.items()],
+            "levels": {str(level): rollup.to_dict() for level, rollup in self.levels.items()},
+            "tags": {tag: rollup.to_dict() for tag, rollup in self.tags.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a HistoryAnalytics instance from a dictionary"""
+        analytics = cls(data["window_days"])
+        analytics.offset = data["offset"]
+        for card_id, at, level, tag in data["open_draws"]:
+            analytics.open_draws[card_id] = (datetime.fromisoformat(at), level, tag)
+        for level, rollup in data["levels"].items():
+            analytics.levels[int(level)] = Rollup.from_dict(rollup)
+        for tag, rollup in data["tags"].items():
+            analytics.tags[tag] = Rollup.from_dict(rollup)
+        return analytics
@@ -1,40 +1,79 @@
+import heapq
+import itertools
 import random
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from .models import Card, CardStatus
-from .storage import Storage
+from .storage import DEFAULT_DECK, Storage
 
-class Divination:
-    """Divination class, responsible for drawing cards from the deck box"""
-    def __init__(self):
-        """Initialize divination class"""
-        self.storage = Storage()
-        # Define probability weights for different levels (higher level has lower weight)
-        self.level_weights = {
-            1: 4,   # Within 15 minutes, highest probability
-            2: 3,   # 16-30 minutes, higher probability
-            3: 2,   # 31-60 minutes, lower probability
-            4: 1    # Over 60 minutes, lowest probability
-        }
+# Upper bound on the number of deck shards loaded concurrently
+MAX_LOAD_WORKERS = 8
+
+# Define probability weights for different levels (higher level has lower weight)
+DEFAULT_LEVEL_WEIGHTS = {
+    1: 4,   # Within 15 minutes, highest probability
+    2: 3,   # 16-30 minutes, higher probability
+    3: 2,   # 31-60 minutes, lower probability
+    4: 1    # Over 60 minutes, lowest probability
+}
+
+# Upper bound on the number of steps (partial combinations explored and
+# candidate cards examined) of a constrained draw
+MAX_SEARCH_STEPS = 20000
+
+# Priority of cards without one (priorities range from 1, lowest, to 5, highest)
+DEFAULT_PRIORITY = 3
+
+# Number of days before its due date from which a card becomes more urgent
+DUE_HORIZON_DAYS = 7
+
+def urgency_score(card, level_weights=None, now=None):
+    """Score how urgently a card should be worked on (higher is more urgent)
     
-    def _get_available_cards(self):
-        """Get all available cards (pending and predecessors completed)"""
-        cards = self.storage.load_cards()
-        available_cards = []
+    The level weight is scaled by the card's priority. Cards due within
+    DUE_HORIZON_DAYS get their score multiplied by one more for every day
+    closer they are to their due date, and overdue cards keep growing more
+    urgent every day.
+    """
+    level_weights = level_weights or DEFAULT_LEVEL_WEIGHTS
+    score = level_weights[card.level] * (card.priority or DEFAULT_PRIORITY)
+    if card.due_at:
+        days_left = (card.due_at - (now or datetime.now())).total_seconds() / 86400
+        score *= 1 + max(DUE_HORIZON_DAYS - days_left, 0)
+    return score
+
+class DrawConstraints:
+    """Constraints on the combination of cards drawn by a divination"""
+    def __init__(self, tag_min=None, tag_max=None, level_max=None, max_cards=5):
+        """Initialize draw constraints
         
-        for card in cards:
-            if card.status != CardStatus.PENDING:
-                continue
-            
-            # Check if predecessor cards exist and are completed
-            if card.predecessor_id:
-                predecessor = self.storage.get_card_by_id(card.predecessor_id)
-                if not predecessor or predecessor.status != CardStatus.COMPLETED:
-                    continue
-            
-            available_cards.append(card)
+        `tag_min` and `tag_max` map tags to the minimum and maximum number of
+        cards with that tag, `level_max` maps levels to the maximum number of
+        cards of that level.
+        """
+        self.tag_min = {tag: count for tag, count in (tag_min or {}).items() if count > 0}
+        self.tag_max = dict(tag_max or {})
+        self.level_max = dict(level_max or {})
+        self.max_cards = max_cards
+    
+    def allows(self, card, tag_counts, level_counts):
+        """Check whether a card can be added to a combination with the given tag and level counts"""
+        return (tag_counts[card.tag] < self.tag_max.get(card.tag, float('inf'))
+                and level_counts[card.level] < self.level_max.get(card.level, float('inf')))
+
+class CardSampler:
+    """Card sampler, responsible for the weighted random drawing itself (independent of storage)"""
+    def __init__(self, level_weights=None, rng=None):
+        """Initialize card sampler
         
-        return available_cards
+        `rng` is a random.Random instance to draw with; the module-level random
+        generator is used by default.
+        """
+        self.level_weights = dict(level_weights or DEFAULT_LEVEL_WEIGHTS)
+        self.random = rng or random
     
-    def _select_card_by_probability(self, available_cards):
+    def select_card(self, available_cards):
         """Select a card based on probability weights"""
         if not available_cards:
             return None
@@ -42,10 +81,10 @@ class Divination:
         # Calculate total weight
         total_weight = sum(self.level_weights[card.level] for card in available_cards)
         if total_weight == 0:
-            return random.choice(available_cards)
+            return self.random.choice(available_cards)
         
         # Select randomly based on weights
-        random_value = random.uniform(0, total_weight)
+        random_value = self.random.uniform(0, total_weight)
         current_weight = 0
         
         for card in available_cards:
@@ -54,11 +93,10 @@ class Divination:
                 return card
         
         # Prevent calculation errors
-        return random.choice(available_cards)
+        return self.random.choice(available_cards)
     
-    def perform_divination(self, min_time=90, max_time=150):
-        """Perform divination to draw a combination of cards within specified time range"""
-        available_cards = self._get_available_cards()
+    def draw_combination(self, available_cards, min_time=90, max_time=150):
+        """Draw a combination of cards within specified time range"""
         if not available_cards:
             return None
         
@@ -76,7 +114,7 @@ class Divination:
         
         for _ in range(max_attempts):
             # Randomly select number of cards (1-5)
-            num_cards = random.randint(1, min(5, len(available_cards)))
+            num_cards = self.random.randint(1, min(5, len(available_cards)))
             
             # Select cards based on probability
             selected_cards = []
@@ -87,7 +125,7 @@ class Divination:
                 if not available_pool:
                     break
                     
-                card = self._select_card_by_probability(available_pool)
+                card = self.select_card(available_pool)
                 selected_cards.append(card)
                 total_time += card.estimated_time
                 available_pool.remove(card)
@@ -104,6 +142,370 @@ class Divination:
         # If no exact matching combination found, return the closest one
         return best_combination
     
+    def draw_constrained(self, available_cards, min_time, max_time, constraints, max_steps=MAX_SEARCH_STEPS):
+        """Draw a combination of cards within the time range satisfying the constraints
+        
+        Instead of drawing random combinations until one fits, this searches
+        the combinations depth first, pruning every branch that can no longer
+        satisfy the constraints. Cards are visited in a weighted random order,
+        so the level weights still shape which combination is found. Every
+        candidate card examined counts against the search budget, so a draw
+        takes at most `max_steps` steps however large the deck. Returns None if
+        there is no such combination or the search budget runs out.
+        """
+        tag_counts = Counter()
+        level_counts = Counter()
+        cards = self._weighted_shuffle([
+            card for card in available_cards
+            if card.estimated_time <= max_time and constraints.allows(card, tag_counts, level_counts)
+        ])
+        max_cards = len(cards) if constraints.max_cards is None else constraints.max_cards
+        min_tags = list(constraints.tag_min)
+        
+        # For every position, how many cards of each required tag and how long
+        # the longest and the shortest card are there from that position on
+        suffix_tags = [[0] * len(min_tags) for _ in range(len(cards) + 1)]
+        suffix_max_time = [0] * (len(cards) + 1)
+        suffix_min_time = [float('inf')] * (len(cards) + 1)
+        for i in range(len(cards) - 1, -1, -1):
+            suffix_tags[i] = [count + (cards[i].tag == tag) for count, tag in zip(suffix_tags[i + 1], min_tags)]
+            suffix_max_time[i] = max(suffix_max_time[i + 1], cards[i].estimated_time)
+            suffix_min_time[i] = min(suffix_min_time[i + 1], cards[i].estimated_time)
+        
+        selected = []
+        steps = 0
+        
+        def search(start, total_time):
+            nonlocal steps
+            steps += 1
+            if steps > max_steps:
+                return None
+            
+            deficits = [constraints.tag_min[tag] - tag_counts[tag] for tag in min_tags]
+            if selected and min_time <= total_time <= max_time and all(deficit <= 0 for deficit in deficits):
+                return list(selected)
+            
+            # Prune when the remaining slots or cards cannot make up for what is missing
+            slots = max_cards - len(selected)
+            if slots <= 0 or sum(max(deficit, 0) for deficit in deficits) > slots:
+                return None
+            if total_time + slots * suffix_max_time[start] < min_time:
+                return None
+            if total_time + suffix_min_time[start] > max_time:
+                return None
+            if any(available < deficit for available, deficit in zip(suffix_tags[start], deficits)):
+                return None
+            
+            for i in range(start, len(cards)):
+                steps += 1
+                if steps > max_steps:
+                    return None
+                card = cards[i]
+                if total_time + card.estimated_time > max_time or not constraints.allows(card, tag_counts, level_counts):
+                    continue
+                selected.append(card)
+                tag_counts[card.tag] += 1
+                level_counts[card.level] += 1
+                result = search(i + 1, total_time + card.estimated_time)
+                selected.pop()
+                tag_counts[card.tag] -= 1
+                level_counts[card.level] -= 1
+                if result:
+                    return result
+            return None
+        
+        return search(0, 0)
+    
+    def _weighted_shuffle(self, cards):
+        """Shuffle cards so that cards with higher level weights tend to come first"""
+        # Weighted random sampling keys (Efraimidis-Spirakis): u ** (1 / weight)
+        keys = []
+        for card in cards:
+            weight = self.level_weights[card.level]
+            keys.append(self.random.random() ** (1 / weight) if weight > 0 else 0)
+        order = sorted(range(len(cards)), key=keys.__getitem__, reverse=True)
+        return [cards[i] for i in order]
+
+class ReadyQueue:
+    """Heap of available cards, most urgent first
+    
+    Removed and rescored cards are only marked as removed instead of being
+    searched for in the heap, so adding, removing and popping a card all take
+    O(log n), except that popping past k more urgent cards that are too long
+    takes O(k log n). Scores are computed against the queue's reference time `now`,
+    which keeps the heap order valid for as long as the queue lives.
+    """
+    def __init__(self, cards=(), level_weights=None, now=None):
+        self.level_weights = dict(level_weights or DEFAULT_LEVEL_WEIGHTS)
+        self.now = now or datetime.now()
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self.extend(cards)
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, card_id):
+        return card_id in self._entries
+    
+    def push(self, card):
+        """Add a card, or rescore it if it is already queued"""
+        self.remove(card.id)
+        entry = self._entry(card)
+        self._entries[card.id] = entry
+        heapq.heappush(self._heap, entry)
+    
+    def extend(self, cards):
+        """Add several cards, or rescore them if they are already queued, heapifying once in O(n)"""
+        for card in cards:
+            self.remove(card.id)
+            entry = self._entry(card)
+            self._entries[card.id] = entry
+            self._heap.append(entry)
+        heapq.heapify(self._heap)
+    
+    def _entry(self, card):
+        """Make the heap entry of a card; ties are broken by insertion order"""
+        return [-urgency_score(card, self.level_weights, self.now), next(self._counter), card]
+    
+    def remove(self, card_id):
+        """Remove a card if it is queued"""
+        entry = self._entries.pop(card_id, None)
+        if entry is None:
+            return
+        entry[-1] = None
+        # Drop the removed entries once they make up most of the heap
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [entry for entry in self._heap if entry[-1] is not None]
+            heapq.heapify(self._heap)
+    
+    def peek(self):
+        """Get the most urgent card without removing it"""
+        while self._heap and self._heap[0][-1] is None:
+            heapq.heappop(self._heap)
+        return self._heap[0][-1] if self._heap else None
+    
+    def pop(self, max_time=None):
+        """Remove and return the most urgent card taking at most `max_time` minutes
+        
+        More urgent cards that are too long are skipped and stay queued.
+        Returns None if no card fits.
+        """
+        entry = self._pop_entry(max_time)
+        return entry[-1] if entry else None
+    
+    def _pop_entry(self, max_time=None):
+        """Remove and return the heap entry of the most urgent card taking at most `max_time` minutes"""
+        skipped = []
+        found = None
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if entry[-1] is None:
+                continue
+            if max_time is None or entry[-1].estimated_time <= max_time:
+                found = entry
+                del self._entries[entry[-1].id]
+                break
+            skipped.append(entry)
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return found
+    
+    def draw(self, min_time=90, max_time=150, max_cards=5):
+        """Draw the most urgent cards that fit into the time range together
+        
+        Cards are taken in order of urgency, skipping cards that no longer fit
+        into the remaining time, until the cards add up to `min_time`. The
+        queue itself is left unchanged. Returns None if no card fits.
+        """
+        entries = []
+        total_time = 0
+        while len(entries) < max_cards and total_time < min_time:
+            entry = self._pop_entry(max_time - total_time)
+            if entry is None:
+                break
+            entries.append(entry)
+            total_time += entry[-1].estimated_time
+        # Put back the original entries so ties keep their insertion order
+        for entry in entries:
+            self._entries[entry[-1].id] = entry
+            heapq.heappush(self._heap, entry)
+        return [entry[-1] for entry in entries] or None
+
+class AvailabilityIndex:
+    """Index of the available cards (pending and predecessors completed) of a set of cards
+    
+    The index is kept up to date as cards change, so callers holding a deck in
+    memory never have to rescan it.
+    """
+    def __init__(self, cards, is_archived=lambda card_id: False, ready_queue=None):
+        """Initialize availability index
+        
+        `is_archived` tells whether a card that is not in `cards` was archived,
+        which makes it a completed predecessor. If a `ready_queue` is given,
+        it is kept holding exactly the available cards.
+        """
+        self.cards = {}
+        self.available = {}
+        self.dependents = defaultdict(set)
+        self.is_archived = is_archived
+        # The queue is filled with all initially available cards at once
+        self.ready_queue = None
+        for card in cards:
+            self.cards[card.id] = card
+            if card.predecessor_id:
+                self.dependents[card.predecessor_id].add(card.id)
+        for card in self.cards.values():
+            self._refresh(card)
+        self.ready_queue = ready_queue
+        if ready_queue is not None:
+            ready_queue.extend(self.available.values())
+    
+    def available_cards(self):
+        """Get all available cards"""
+        return list(self.available.values())
+    
+    def update(self, card):
+        """Add or update a card, returning the cards whose availability changed"""
+        old = self.cards.get(card.id)
+        if old and old.predecessor_id:
+            self.dependents[old.predecessor_id].discard(card.id)
+        if card.predecessor_id:
+            self.dependents[card.predecessor_id].add(card.id)
+        self.cards[card.id] = card
+        return self._refresh_with_dependents(card.id)
+    
+    def remove(self, card_id):
+        """Remove a card, returning the cards whose availability changed"""
+        card = self.cards.pop(card_id, None)
+        if card is None:
+            return []
+        if card.predecessor_id:
+            self.dependents[card.predecessor_id].discard(card_id)
+        if self.ready_queue is not None:
+            self.ready_queue.remove(card_id)
+        changed = [card] if self.available.pop(card_id, None) else []
+        return changed + self._refresh_dependents(card_id)
+    
+    def _refresh_with_dependents(self, card_id):
+        """Recheck a card and the cards depending on it"""
+        changed = [self.cards[card_id]] if self._refresh(self.cards[card_id]) else []
+        return changed + self._refresh_dependents(card_id)
+    
+    def _refresh_dependents(self, card_id):
+        """Recheck the cards depending on a card"""
+        return [self.cards[dependent] for dependent in self.dependents.get(card_id, ()) if self._refresh(self.cards[dependent])]
+    
+    def _is_available(self, card):
+        """Check whether a card is pending with its predecessor completed (archived cards are completed)"""
+        if card.status != CardStatus.PENDING:
+            return False
+        if not card.predecessor_id:
+            return True
+        predecessor = self.cards.get(card.predecessor_id)
+        if predecessor is not None:
+            return predecessor.status == CardStatus.COMPLETED
+        return self.is_archived(card.predecessor_id)
+    
+    def _refresh(self, card):
+        """Recheck whether a card is available, returning True if that changed"""
+        was_available = card.id in self.available
+        if self._is_available(card):
+            self.available[card.id] = card
+            if self.ready_queue is not None:
+                # Rescore the card even if it stays available, its due date or priority may have changed
+                self.ready_queue.push(card)
+            return not was_available
+        self.available.pop(card.id, None)
+        if self.ready_queue is not None:
+            self.ready_queue.remove(card.id)
+        return was_available
+
+class Divination:
+    """Divination class, responsible for drawing cards from the deck box"""
+    def __init__(self, deck=DEFAULT_DECK, decks=None):
+        """Initialize divination class
+        
+        Cards are drawn from `deck` unless `decks` lists several decks to draw
+        from together, which must exist. Divination results are always saved
+        to `deck`.
+        """
+        self.storage = Storage(deck)
+        self.decks = list(decks) if decks else [self.storage.deck]
+        # Deck of every card loaded from another deck than `deck`
+        self.card_decks = {}
+        self._archived_ids = None
+        self.sampler = CardSampler()
+    
+    @property
+    def level_weights(self):
+        """Probability weights for the different card levels"""
+        return self.sampler.level_weights
+    
+    @level_weights.setter
+    def level_weights(self, level_weights):
+        self.sampler.level_weights = level_weights
+    
+    def _load_cards(self):
+        """Load the cards of all decks taking part in the divination"""
+        if self.decks == [self.storage.deck]:
+            return self._load_deck(self.storage)
+        
+        # Load the deck shards in parallel and merge them
+        with ThreadPoolExecutor(max_workers=min(len(self.decks), MAX_LOAD_WORKERS)) as executor:
+            shards = executor.map(lambda deck: self._load_deck(self._open_deck(deck)), self.decks)
+            cards = []
+            for deck, shard in zip(self.decks, shards):
+                if deck != self.storage.deck:
+                    self.card_decks.update((card.id, deck) for card in shard)
+                cards.extend(shard)
+            return cards
+    
+    def deck_of(self, card):
+        """Get the name of the deck a drawn card came from"""
+        return self.card_decks.get(card.id, self.storage.deck)
+    
+    def _open_deck(self, deck):
+        """Open one of the decks taking part in the divination"""
+        return self.storage if deck == self.storage.deck else Storage(deck, create=False)
+    
+    @staticmethod
+    def _load_deck(storage):
+        """Load the cards of a deck, creating the current cards of its recurring templates first"""
+        storage.materialize_templates()
+        return storage.load_cards()
+    
+    def _is_archived(self, card_id):
+        """Check whether a card has been archived in any of the decks"""
+        if self._archived_ids is None:
+            self._archived_ids = set()
+            for deck in self.decks:
+                self._archived_ids.update(self._open_deck(deck).archived_ids())
+        return card_id in self._archived_ids
+    
+    def _get_available_cards(self):
+        """Get all available cards (pending and predecessors completed)"""
+        return AvailabilityIndex(self._load_cards(), self._is_archived).available_cards()
+    
+    def _select_card_by_probability(self, available_cards):
+        """Select a card based on probability weights"""
+        return self.sampler.select_card(available_cards)
+    
+    def perform_divination(self, min_time=90, max_time=150):
+        """Perform divination to draw a combination of cards within specified time range"""
+        return self.sampler.draw_combination(self._get_available_cards(), min_time, max_time)
+    
+    def perform_constrained_divination(self, constraints, min_time=90, max_time=150):
+        """Perform divination to draw a combination of cards within specified time range satisfying the constraints"""
+        return self.sampler.draw_constrained(self._get_available_cards(), min_time, max_time, constraints)
+    
+    def perform_urgent_divination(self, min_time=90, max_time=150, max_cards=5):
+        """Draw the most urgent cards (by due date, priority and level weight) within specified time range"""
+        ready_queue = ReadyQueue(level_weights=self.level_weights)
+        AvailabilityIndex(self._load_cards(), self._is_archived, ready_queue)
+        return ready_queue.draw(min_time, max_time, max_cards)
+    
     def draw_single_card(self):
         """Draw a single card"""
         available_cards = self._get_available_cards()
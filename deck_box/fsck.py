@@ -0,0 +1,442 @@
+import gzip
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import zlib
+from collections import Counter, defaultdict
+from contextlib import closing
+from .migrations import READ_CHUNK_SIZE, SCHEMA_VERSION, file_header, read_version, upgrade_card, upgrade_divination
+from .models import Card, DivinationResult
+from .storage import Storage, file_lock
+
+# Number of example card IDs kept for every kind of problem
+MAX_EXAMPLES = 10
+
+# A record still unfinished after this many characters is treated as damaged
+# instead of being read further, which bounds the memory used on damaged files
+MAX_RECORD_SIZE = 1 << 20
+
+# Number of rows written to or read from the scratch database at a time
+BATCH_SIZE = 1000
+
+# Whitespace and commas between the records of an array
+SEPARATORS = re.compile(r"[\s,]*")
+
+# Start of any object, where reading resumes after damage until the layout
+# of the records is known
+ANY_OBJECT = re.compile("{")
+
+# Cards seen while checking: the version of every card that counts (the last
+# one), its predecessor and what is wrong with it. The database is a private
+# temporary file, so checking a deck of any size takes bounded memory.
+SCRATCH_SCHEMA = """
+CREATE TABLE cards (
+    id TEXT PRIMARY KEY, seq INTEGER NOT NULL, predecessor TEXT, copies INTEGER NOT NULL DEFAULT 1,
+    bad_level INTEGER NOT NULL, walk INTEGER, fix_predecessor INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE archived (id TEXT PRIMARY KEY);
+"""
+
+PROBLEMS = {
+    "duplicate": "重复的卡片ID",
+    "dangling": "前置卡片不存在",
+    "cycle": "前置卡片循环依赖",
+    "level": "级别与预计时间不符"
+}
+
+def iter_salvaged_records(f):
+    """Stream the objects of the first JSON array in a text file, skipping damaged parts
+
+    Like iter_json_array, but instead of failing on invalid JSON it yields
+    None for every damaged stretch of the file and resumes at the next record.
+    Records are written one per line (or one per indented block by older
+    versions), so the next record is the next object starting a line with
+    the indentation of the first record; objects nested in a damaged record
+    are indented differently or do not start a line, and are skipped with
+    it. Only in files without line breaks between records does reading
+    resume at the next object of any kind.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def read_more():
+        nonlocal buffer, pos, eof
+        chunk = f.read(READ_CHUNK_SIZE)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return not eof
+
+    # If the header is damaged, records are looked for from the start of the file
+    while read_more() and "[" not in buffer and len(buffer) < MAX_RECORD_SIZE:
+        pass
+    start = buffer.find("[")
+    if start >= 0:
+        pos = start + 1
+
+    skipping = False
+    # Pattern of the start of a record and how many characters it spans
+    boundary = None
+    boundary_size = 1
+    # What precedes the first record on its line (None if it does not start a line)
+    indent = None
+    while True:
+        separator = SEPARATORS.match(buffer, pos)
+        pos = separator.end()
+        if boundary is None:
+            text = separator.group()
+            if "\n" in text:
+                indent = text[text.rfind("\n") + 1:]
+            elif indent is not None:
+                indent += text
+        if pos == len(buffer):
+            if not read_more():
+                return
+            continue
+        if buffer[pos] == "]":
+            return
+
+        if buffer[pos] == "{":
+            if boundary is None:
+                if indent is not None and not indent.strip(" \t"):
+                    boundary = re.compile("\n" + re.escape(indent) + "{")
+                    boundary_size = len(indent) + 2
+                else:
+                    boundary = ANY_OBJECT
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # Strings cannot span lines, so an error followed by a line
+                # break is damage, anything else may just need more input
+                if not eof and buffer.find("\n", e.pos) < 0 and len(buffer) - pos < MAX_RECORD_SIZE:
+                    read_more()
+                    continue
+            else:
+                skipping = False
+                pos = end
+                yield item
+                continue
+
+        if not skipping:
+            skipping = True
+            yield None
+        # Skip to the next record, keeping the end of the buffer in case a
+        # record boundary is split between two reads
+        search_from = pos + 1
+        while True:
+            match = (boundary or ANY_OBJECT).search(buffer, search_from)
+            if match:
+                pos = match.end() - 1
+                break
+            pos = max(search_from, len(buffer) - boundary_size + 1)
+            if not read_more():
+                return
+            search_from = 0
+
+def _readable_card(data, version):
+    """Upgrade a record to the current version, returning None unless it is a readable card"""
+    if not isinstance(data, dict) or not isinstance(data.get("id"), str):
+        return None
+    try:
+        data = upgrade_card(data, version)
+        Card.from_dict(data)
+        if not isinstance(data["estimated_time"], int) or not isinstance(data["name"], str):
+            return None
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+    return data
+
+def _readable_divination(data, version):
+    """Upgrade a record to the current version, returning None unless it is a readable divination result"""
+    if (not isinstance(data, dict) or not isinstance(data.get("id"), str)
+            or not isinstance(data.get("cards"), list) or not isinstance(data.get("created_at"), str)):
+        return None
+    try:
+        data = upgrade_divination(data, version)
+        DivinationResult.from_dict(data)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+    return data
+
+class FsckReport:
+    """Problems found in a deck by DeckChecker"""
+    def __init__(self):
+        self.cards = 0
+        self.damaged = Counter()
+        self.problems = Counter()
+        self.examples = defaultdict(list)
+        self.repaired = False
+
+    @property
+    def clean(self):
+        """Whether no problem was found"""
+        return not self.damaged and not self.problems
+
+    def add(self, kind, card_id):
+        """Record a problem with a card"""
+        self.problems[kind] += 1
+        if len(self.examples[kind]) < MAX_EXAMPLES:
+            self.examples[kind].append(card_id)
+
+class DeckChecker:
+    """Integrity checker of the data files of a deck
+
+    The data files are streamed, never parsed as a whole, so damaged files
+    can be checked and their readable records salvaged. Works directly on the
+    files: opening the deck with Storage may itself fail on damaged files.
+    """
+    def __init__(self, deck):
+        self.deck_dir = Storage.deck_path(deck)
+        self.cards_file = self.deck_dir / "cards.json"
+        self.journal_file = self.deck_dir / "cards.journal"
+        self.divination_file = self.deck_dir / "divination.json"
+        self.archive_file = self.deck_dir / "archive.jsonl.gz"
+        self.archive_ids_file = self.deck_dir / "archive.ids"
+
+    def check(self, repair=False):
+        """Check the deck, repairing what can be repaired if `repair` is set, and report the problems"""
+        report = FsckReport()
+        # The deck must not change while it is checked, nor be read while it is repaired
+        with file_lock(self.deck_dir / "cards.lock", exclusive=repair), closing(sqlite3.connect("")) as db:
+            db.executescript(SCRATCH_SCHEMA)
+            self._scan_cards(db, report)
+            self._load_archived_ids(db)
+            self._find_dangling(db, report)
+            self._find_cycles(db, report)
+            self._count_problems(db, report)
+            if repair and (report.problems or report.damaged):
+                self._rewrite_cards(db)
+        for name, damaged in (("divination.json", self._check_divinations(repair)), ("archive.jsonl.gz", self._check_archive(repair))):
+            if damaged:
+                report.damaged[name] = damaged
+        report.repaired = repair and not report.clean
+        return report
+
+    def _cards_version(self):
+        """Read the version of the cards file, assuming the oldest one if its header is damaged"""
+        try:
+            return min(read_version(self.cards_file), SCHEMA_VERSION)
+        except ValueError:
+            # Upgrade steps are idempotent, so upgrading current records does no harm
+            return 1
+
+    def _iter_records(self, report=None):
+        """Stream the readable cards of the cards file and the journal as (seq, is_base, entry) triples
+
+        Journal deletes are yielded as {"op": "delete", "id": ...} entries.
+        """
+        version = self._cards_version()
+        seq = 0
+        if self.cards_file.exists():
+            with open(self.cards_file, "r", encoding="utf-8", errors="replace") as f:
+                for data in iter_salvaged_records(f):
+                    data = _readable_card(data, version) if data is not None else None
+                    if data is None:
+                        if report is not None:
+                            report.damaged["cards.json"] += 1
+                        continue
+                    seq += 1
+                    yield seq, True, data
+
+        if self.journal_file.exists():
+            with open(self.journal_file, "rb") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        entry = json.loads(line)
+                        if entry["op"] == "delete":
+                            seq += 1
+                            yield seq, False, {"op": "delete", "id": entry["id"]}
+                            continue
+                        data = _readable_card(entry["card"], version)
+                    except (ValueError, KeyError, TypeError):
+                        data = None
+                    if data is None:
+                        if report is not None:
+                            report.damaged["cards.journal"] += 1
+                        continue
+                    seq += 1
+                    yield seq, False, data
+
+    def _scan_cards(self, db, report):
+        """Record the version of every card that counts in the scratch database"""
+        with db:
+            for seq, is_base, data in self._iter_records(report):
+                if data.get("op") == "delete":
+                    db.execute("DELETE FROM cards WHERE id = ?", (data["id"],))
+                    continue
+                bad_level = data["level"] != Card.level_for_time(data["estimated_time"])
+                # A card appearing twice in the cards file is a duplicate;
+                # journal entries replace earlier versions by design
+                db.execute(
+                    "INSERT INTO cards (id, seq, predecessor, bad_level) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (id) DO UPDATE SET seq = excluded.seq, predecessor = excluded.predecessor, "
+                    "bad_level = excluded.bad_level, copies = copies + ?",
+                    (data["id"], seq, data.get("predecessor_id"), bad_level, int(is_base))
+                )
+
+    def _load_archived_ids(self, db):
+        """Record the IDs of the archived cards, which are valid predecessors"""
+        if not self.archive_ids_file.exists():
+            return
+        with open(self.archive_ids_file, "r", encoding="utf-8", errors="replace") as f, db:
+            db.executemany("INSERT OR IGNORE INTO archived VALUES (?)", ((line.strip(),) for line in f if line.strip()))
+
+    def _find_dangling(self, db, report):
+        """Mark the cards whose predecessor does not exist"""
+        with db:
+            db.execute(
+                "UPDATE cards SET fix_predecessor = 1 WHERE predecessor IS NOT NULL "
+                "AND NOT EXISTS (SELECT 1 FROM cards AS p WHERE p.id = cards.predecessor) "
+                "AND NOT EXISTS (SELECT 1 FROM archived AS a WHERE a.id = cards.predecessor)"
+            )
+        for (card_id,) in db.execute("SELECT id FROM cards WHERE fix_predecessor = 1"):
+            report.add("dangling", card_id)
+
+    def _find_cycles(self, db, report):
+        """Mark one card of every predecessor cycle, so the cycle is broken there
+
+        Every card has at most one predecessor, so following predecessors from
+        each card not visited yet either ends or runs into a card visited
+        before; if that card was visited by the same walk, the walk found a
+        cycle. Every card is visited once, which keeps this linear.
+        """
+        walk = 0
+        last_rowid = 0
+        with db:
+            while True:
+                batch = db.execute(
+                    "SELECT rowid, id FROM cards WHERE rowid > ? AND predecessor IS NOT NULL AND walk IS NULL ORDER BY rowid LIMIT ?",
+                    (last_rowid, BATCH_SIZE)
+                ).fetchall()
+                if not batch:
+                    return
+                last_rowid = batch[-1][0]
+                for _, card_id in batch:
+                    walk += 1
+                    while card_id is not None:
+                        row = db.execute("SELECT predecessor, walk FROM cards WHERE id = ?", (card_id,)).fetchone()
+                        if row is None:
+                            # A dangling or archived predecessor ends the chain
+                            break
+                        predecessor, seen = row
+                        if seen is not None:
+                            if seen == walk:
+                                self._mark_cycle(db, card_id, report)
+                            break
+                        db.execute("UPDATE cards SET walk = ? WHERE id = ?", (walk, card_id))
+                        card_id = predecessor
+
+    @staticmethod
+    def _mark_cycle(db, entry_id, report):
+        """Report the cards of the cycle containing `entry_id` and mark it to be broken there"""
+        card_id = entry_id
+        while True:
+            report.add("cycle", card_id)
+            card_id = db.execute("SELECT predecessor FROM cards WHERE id = ?", (card_id,)).fetchone()[0]
+            if card_id == entry_id:
+                break
+        db.execute("UPDATE cards SET fix_predecessor = 1 WHERE id = ?", (entry_id,))
+
+    @staticmethod
+    def _count_problems(db, report):
+        """Report the duplicate cards and the cards whose level does not match their time"""
+        report.cards = db.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+        for kind, condition in (("duplicate", "copies > 1"), ("level", "bad_level")):
+            for (card_id,) in db.execute(f"SELECT id FROM cards WHERE {condition}"):
+                report.add(kind, card_id)
+
+    def _rewrite_cards(self, db):
+        """Write the repaired deck to the cards file, folding in the journal
+
+        Only the version of each card that counts is kept, levels are
+        recalculated, and dangling predecessors and cycles are cleared. The
+        index files are removed and rebuilt the next time the deck is used.
+        """
+        fd, tmp_file = tempfile.mkstemp(prefix=self.cards_file.name + ".", suffix=".tmp", dir=self.deck_dir)
+        with open(fd, "w", encoding="utf-8") as f:
+            f.write(file_header("cards"))
+            separator = "\n"
+            for seq, _, data in self._iter_records():
+                if data.get("op") == "delete":
+                    continue
+                row = db.execute("SELECT seq, fix_predecessor FROM cards WHERE id = ?", (data["id"],)).fetchone()
+                if row is None or row[0] != seq:
+                    continue
+                data["level"] = Card.level_for_time(data["estimated_time"])
+                if row[1]:
+                    data["predecessor_id"] = None
+                f.write(separator + json.dumps(data, ensure_ascii=False))
+                separator = ",\n"
+            f.write("\n]}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.cards_file)
+        open(self.journal_file, "wb").close()
+        for name in ("cards.index", "search.index"):
+            for path in self.deck_dir.glob(name + "*"):
+                path.unlink()
+
+    def _check_divinations(self, repair):
+        """Count the unreadable divination results, dropping them if `repair` is set"""
+        if not self.divination_file.exists():
+            return 0
+        try:
+            version = min(read_version(self.divination_file), SCHEMA_VERSION)
+        except ValueError:
+            version = 1
+        damaged = 0
+        readable = []
+        with open(self.divination_file, "r", encoding="utf-8", errors="replace") as f:
+            for data in iter_salvaged_records(f):
+                data = _readable_divination(data, version)
+                if data is None:
+                    damaged += 1
+                else:
+                    readable.append(data)
+        if repair and damaged:
+            # Only the last few divination results are kept, so they fit in memory
+            tmp_file = self.divination_file.with_name(self.divination_file.name + ".tmp")
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                f.write(file_header("divinations"))
+                for i, data in enumerate(readable):
+                    f.write((",\n" if i else "\n") + json.dumps(data, ensure_ascii=False))
+                f.write("\n]}\n")
+            os.replace(tmp_file, self.divination_file)
+        return damaged
+
+    def _check_archive(self, repair):
+        """Count the unreadable archived cards, dropping them if `repair` is set"""
+        if not self.archive_file.exists():
+            return 0
+        damaged = 0
+        tmp_file = self.archive_file.with_name(self.archive_file.name + ".tmp")
+        target = gzip.open(tmp_file, "wt", encoding="utf-8") if repair else None
+        try:
+            with gzip.open(self.archive_file, "rt", encoding="utf-8", errors="replace") as f:
+                try:
+                    for line in f:
+                        try:
+                            data = json.loads(line)
+                            Card.from_dict(data)
+                        except (KeyError, TypeError, ValueError, AttributeError):
+                            damaged += 1
+                            continue
+                        if target:
+                            target.write(line if line.endswith("\n") else line + "\n")
+                except (EOFError, OSError, zlib.error):
+                    # A truncated or corrupt gzip member; everything after it is lost
+                    damaged += 1
+        finally:
+            if target:
+                target.close()
+        if repair and damaged:
+            os.replace(tmp_file, self.archive_file)
+        elif tmp_file.exists():
+            tmp_file.unlink()
+        return damaged
@@ -1,40 +1,115 @@
+import itertools
+from collections import Counter
 import click
 from colorama import Fore, Style
-from .models import Card, Mood, Quality, CardStatus
-from .storage import Storage
-from .divination import Divination
+from .models import Card, Frequency, Mood, Quality, CardStatus, Template
+from .storage import DEFAULT_DECK, Storage, validate_deck_name
+from .analytics import ABANDON_AFTER_DAYS
+from .divination import Divination, DrawConstraints
 from .utils import TaskAnalyzer, VisualEffects
 
+# Accepted formats of due dates on the command line
+DUE_DATE_FORMATS = ['%Y-%m-%d', '%Y-%m-%d %H:%M']
+
+def _validate_deck(ctx, param, value):
+    """Click callback validating a deck name"""
+    try:
+        return validate_deck_name(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+def _parse_decks(ctx, param, value):
+    """Click callback parsing a comma-separated list of deck names"""
+    if not value:
+        return None
+    try:
+        decks = [validate_deck_name(deck.strip()) for deck in value.split(',')]
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    for deck in decks:
+        if not Storage.deck_exists(deck):
+            raise click.BadParameter(f"Unknown deck: {deck!r}")
+    return decks
+
+def _require_deck(obj):
+    """Refuse to work with a deck that does not exist; only adding cards or templates creates a deck"""
+    if not Storage.deck_exists(obj['deck']):
+        raise click.UsageError(f"Unknown deck: {obj['deck']!r} (see 'deck-box show decks')")
+
+def _parse_limits(key_type):
+    """Create a click callback parsing repeated KEY=COUNT values into a dict"""
+    def callback(ctx, param, values):
+        limits = {}
+        for value in values:
+            key, separator, count = value.partition('=')
+            try:
+                limits[key_type(key)] = int(count)
+            except ValueError:
+                raise click.BadParameter(f"Expected KEY=COUNT, got {value!r}")
+            if not separator:
+                raise click.BadParameter(f"Expected KEY=COUNT, got {value!r}")
+        return limits
+    return callback
+
+def _parse_due(ctx, param, value):
+    """Click callback parsing an optional due date, where an empty string clears it"""
+    if not value:
+        return value
+    return click.DateTime(DUE_DATE_FORMATS).convert(value, param, ctx)
+
+def _resolve_card_id(storage, card_id):
+    """Expand a card ID prefix to the full card ID
+    
+    Unknown IDs are returned unchanged so the caller reports them as missing.
+    Returns None (after reporting it) if the prefix matches several cards.
+    """
+    matches = storage.resolve_card_id(card_id)
+    if len(matches) > 1:
+        click.echo(f"{Fore.RED}❌ 卡片ID前缀 '{card_id}' 匹配多张卡片，请输入更多位！{Style.RESET_ALL}")
+        return None
+    return matches[0] if matches else card_id
+
 @click.group()
-def cli():
+@click.option('--deck', '-D', default=DEFAULT_DECK, show_default=True, callback=_validate_deck, help='Name of the deck to work with (decks are stored separately under DECK_BOX_HOME)')
+@click.pass_context
+def cli(ctx, deck):
     """🧙‍♀️ Deck Box - A card-based task management tool for overcoming executive dysfunction
     
     Transform your tasks into a card game! Deck Box helps you manage your to-do list by breaking 
     tasks into manageable "cards" with different levels based on estimated time. Use the divination 
     feature to randomly draw cards from your deck, making task selection feel like a fun game 
     rather than an overwhelming chore.
+    
+    Data is stored in ~/.deck_box, or in the directory given by the DECK_BOX_HOME
+    environment variable.
     """
-    pass
+    ctx.ensure_object(dict)
+    ctx.obj['deck'] = deck
 
 @cli.command()
 @click.option('--name', '-n', required=True, help='The name/title of the task card')
 @click.option('--time', '-t', type=int, required=True, help='Estimated time needed to complete the task (in minutes)')
 @click.option('--tag', '-g', help='Optional tag to categorize the card (e.g., work, personal, study)')
 @click.option('--description', '-d', help='Optional detailed description of the task')
-@click.option('--predecessor', '-p', help='Optional ID of a prerequisite task that must be completed first')
-def add(name, time, tag, description, predecessor):
+@click.option('--predecessor', '-p', help='Optional ID (or unique ID prefix) of a prerequisite task that must be completed first')
+@click.option('--due', type=click.DateTime(DUE_DATE_FORMATS), help='Optional due date (e.g. 2024-06-30 or "2024-06-30 18:00")')
+@click.option('--priority', type=click.IntRange(1, 5), help='Optional priority from 1 (lowest) to 5 (highest), 3 by default')
+@click.pass_obj
+def add(obj, name, time, tag, description, predecessor, due, priority):
     """Add a new task card to your deck box
     
     Creates a new task card with the specified details. The card will be automatically assigned
     a level (1-4) based on its estimated time, and analyzed for potential improvements. If the
     task is complex, suggestions will be provided for breaking it down into smaller tasks.
     """
-    storage = Storage()
+    storage = Storage(obj['deck'])
     
     # Check if predecessor card exists
     if predecessor:
-        predecessor_card = storage.get_card_by_id(predecessor)
-        if not predecessor_card:
+        predecessor = _resolve_card_id(storage, predecessor)
+        if not predecessor:
+            return
+        if not storage.get_card_by_id(predecessor) and not storage.is_archived(predecessor):
             click.echo(f"{Fore.RED}❌ 前置卡片ID不存在！{Style.RESET_ALL}")
             return
     
@@ -42,7 +117,7 @@ def add(name, time, tag, description, predecessor):
     warnings, suggestions = TaskAnalyzer.analyze_task(name, time)
     
     # Create new card
-    card = Card(name, time, tag, description, predecessor)
+    card = Card(name, time, tag, description, predecessor, due, priority)
     storage.add_card(card)
     
     # Display addition result
@@ -52,6 +127,10 @@ def add(name, time, tag, description, predecessor):
     click.echo(f"   预计时间: {card.estimated_time}分钟")
     click.echo(f"   级别: {card.level}")
     click.echo(f"   标签: {card.tag if card.tag else '无'}")
+    if card.due_at:
+        click.echo(f"   截止时间: {card.due_at.strftime('%Y-%m-%d %H:%M')}")
+    if card.priority:
+        click.echo(f"   优先级: {card.priority}")
     
     # Display task analysis result
     if warnings:
@@ -66,7 +145,14 @@ def add(name, time, tag, description, predecessor):
 @click.option('--min', type=int, default=90, help='Minimum total execution time for all drawn cards (in minutes)')
 @click.option('--max', type=int, default=150, help='Maximum total execution time for all drawn cards (in minutes)')
 @click.option('--single', is_flag=True, help='Draw only one card')
-def divination(min, max, single):
+@click.option('--decks', callback=_parse_decks, help='Comma-separated names of several decks to draw from together (e.g. work,home)')
+@click.option('--tag-min', multiple=True, callback=_parse_limits(str), metavar='TAG=COUNT', help='Draw at least COUNT cards with this tag (repeatable)')
+@click.option('--tag-max', multiple=True, callback=_parse_limits(str), metavar='TAG=COUNT', help='Draw at most COUNT cards with this tag (repeatable)')
+@click.option('--level-max', multiple=True, callback=_parse_limits(int), metavar='LEVEL=COUNT', help='Draw at most COUNT cards of this level (repeatable)')
+@click.option('--max-cards', type=click.IntRange(min=1), help='Draw at most this many cards')
+@click.option('--urgent', is_flag=True, help='Draw the most urgent cards (by due date and priority) instead of random ones')
+@click.pass_obj
+def divination(obj, min, max, single, decks, tag_min, tag_max, level_max, max_cards, urgent):
     """Perform a divination to randomly draw task cards from your deck
     
     Experience the magic of divination as the system randomly selects cards from your deck that
@@ -75,16 +161,38 @@ def divination(min, max, single):
     
     Example: deck-box divination --min 60 --max 120
     Example: deck-box divination --single
+    Constraints on the mix of cards can be added with --tag-min, --tag-max,
+    --level-max and --max-cards. The cards are then found by a constraint-aware
+    search, which fails fast if no combination can satisfy them.
+    
+    With --urgent no chance is involved: the most urgent cards that fit into
+    the time range are drawn, scored by due date, priority and level.
+    
+    Example: deck-box divination --decks work,home
+    Example: deck-box divination --tag-min work=1 --level-max 4=1 --max-cards 4
+    Example: deck-box divination --urgent --max 60
     """
-    divination = Divination()
+    if urgent and (tag_min or tag_max or level_max):
+        raise click.UsageError("--urgent cannot be combined with --tag-min, --tag-max or --level-max")
+    
+    _require_deck(obj)
+    divination = Divination(obj['deck'], decks)
     
     # Display witch divination effect
     VisualEffects.show_witch_intro()
     
     # Perform card drawing
-    if single:
+    if urgent:
+        if single:
+            selected_cards = divination.perform_urgent_divination(max_time=float('inf'), max_cards=1)
+        else:
+            selected_cards = divination.perform_urgent_divination(min_time=min, max_time=max, max_cards=max_cards or 5)
+    elif single:
         card = divination.draw_single_card()
         selected_cards = [card] if card else None
+    elif tag_min or tag_max or level_max or max_cards:
+        constraints = DrawConstraints(tag_min, tag_max, level_max, max_cards or 5)
+        selected_cards = divination.perform_constrained_divination(constraints, min_time=min, max_time=max)
     else:
         selected_cards = divination.perform_divination(min_time=min, max_time=max)
     
@@ -96,7 +204,7 @@ def divination(min, max, single):
     # Save divination result
     from .models import DivinationResult
     result = DivinationResult(selected_cards)
-    divination.storage.save_divination(result)
+    divination.storage.save_divination(result, divination.card_decks)
     
     # Display drawing result
     click.echo(f"\n{Fore.MAGENTA}🔮 今日占卜结果：{Style.RESET_ALL}")
@@ -116,28 +224,137 @@ def divination(min, max, single):
         
         click.echo(f"   {i}. {Fore.WHITE}{card.name}{Style.RESET_ALL}")
         click.echo(f"      {level_color}级别: {card.level}{Style.RESET_ALL} | 时长: {card.estimated_time}分钟 | 标签: {card.tag if card.tag else '无'}")
+        if len(divination.decks) > 1:
+            click.echo(f"      卡组: {divination.deck_of(card)} | ID: {card.id}")
         if card.description:
             click.echo(f"      描述: {card.description}")
     
     click.echo(f"   {Fore.CYAN}────────────────────────────────────{Style.RESET_ALL}")
-    click.echo(f"   {Fore.YELLOW}💡 提示：完成卡片后使用 'deck-box complete <card_id>' 记录完成情况{Style.RESET_ALL}")
+    if len(divination.decks) > 1:
+        click.echo(f"   {Fore.YELLOW}💡 提示：完成卡片后使用 'deck-box --deck <卡组> complete <card_id>' 记录完成情况{Style.RESET_ALL}")
+    else:
+        click.echo(f"   {Fore.YELLOW}💡 提示：完成卡片后使用 'deck-box complete <card_id>' 记录完成情况{Style.RESET_ALL}")
+
+def _echo_card(card):
+    """Display the details of a card"""
+    status_color = Fore.GREEN if card.status == CardStatus.COMPLETED else Fore.RED
+    status_icon = "✅" if card.status == CardStatus.COMPLETED else "⏳"
+    
+    level_color = {
+        1: Fore.GREEN,
+        2: Fore.BLUE,
+        3: Fore.YELLOW,
+        4: Fore.RED
+    }[card.level]
+    
+    click.echo(f"{status_icon} {Fore.WHITE}{card.name}{Style.RESET_ALL}")
+    click.echo(f"   ID: {card.id}")
+    click.echo(f"   {status_color}状态: {card.status.value}{Style.RESET_ALL}")
+    click.echo(f"   {level_color}级别: {card.level}{Style.RESET_ALL} | 预计时间: {card.estimated_time}分钟")
+    if card.actual_time:
+        click.echo(f"   实际时间: {card.actual_time}分钟")
+    click.echo(f"   标签: {card.tag if card.tag else '无'}")
+    if card.predecessor_id:
+        click.echo(f"   前置卡片: {card.predecessor_id}")
+    if card.due_at or card.priority:
+        due = card.due_at.strftime('%Y-%m-%d %H:%M') if card.due_at else '无'
+        click.echo(f"   截止时间: {due} | 优先级: {card.priority or '默认'}")
+    click.echo(f"{Fore.CYAN}────────────────────────────────────────────────────────────────────{Style.RESET_ALL}")
+
+def _echo_histogram(title, counter, label=str):
+    """Display a counter as a horizontal bar chart"""
+    total = sum(counter.values())
+    if not total:
+        return
+    click.echo(f"\n{Fore.BLUE}{title}{Style.RESET_ALL}")
+    for key in sorted(counter):
+        share = counter[key] / total
+        click.echo(f"   {label(key):>10} {Fore.YELLOW}{'█' * round(share * 40):<40}{Style.RESET_ALL} {share:6.1%}")
+
+@cli.command()
+@click.option('--runs', '-r', type=click.IntRange(min=1), default=1000, show_default=True, help='Number of divinations to simulate')
+@click.option('--workers', '-w', type=click.IntRange(min=1), help='Number of worker processes (default: number of CPUs)')
+@click.option('--min', type=int, default=90, help='Minimum total execution time for all drawn cards (in minutes)')
+@click.option('--max', type=int, default=150, help='Maximum total execution time for all drawn cards (in minutes)')
+@click.option('--seed', type=int, help='Random seed, for reproducible simulations')
+@click.option('--decks', callback=_parse_decks, help='Comma-separated names of several decks to draw from together (e.g. work,home)')
+@click.pass_obj
+def simulate(obj, runs, workers, min, max, seed, decks):
+    """Simulate many divinations to see what they would draw
+    
+    Runs many independent divinations against the cards currently available in
+    your deck (nothing is saved) and shows the distribution of session lengths,
+    card counts, levels and tags. Useful for choosing --min/--max values.
+    
+    Example: deck-box simulate --runs 10000 --workers 4 --min 60 --max 120
+    """
+    from .simulation import BUCKET_MINUTES, simulate as run_simulation
+    
+    # Snapshot the available cards once; the workers never touch storage
+    _require_deck(obj)
+    available_cards = Divination(obj['deck'], decks)._get_available_cards()
+    if not available_cards:
+        click.echo(f"{Fore.RED}❌ 没有可抽取的卡片！{Style.RESET_ALL}")
+        return
+    
+    result = None
+    for result in run_simulation(available_cards, runs, workers, min, max, seed=seed):
+        click.echo(f"\r🔮 已模拟 {result.runs}/{runs} 次占卜...", nl=False)
+    click.echo()
+    
+    drawn = result.runs - result.failures
+    click.echo(f"\n{Fore.MAGENTA}🔮 模拟结果 ({result.runs} 次占卜, {len(available_cards)} 张可用卡片):{Style.RESET_ALL}")
+    click.echo(f"   在时间范围内: {result.in_range / result.runs:.1%} | 抽取失败: {result.failures / result.runs:.1%}")
+    if not drawn:
+        return
+    _echo_histogram("⏱️  总时长 (分钟):", result.total_times, lambda start: f"{start}-{start + BUCKET_MINUTES - 1}")
+    _echo_histogram("🎴 卡片数量:", result.card_counts)
+    _echo_histogram("📶 级别:", result.levels, lambda level: f"级别 {level}")
+    _echo_histogram("🏷️  标签:", result.tags, lambda tag: tag or "无")
 
 @cli.command()
-@click.argument('what', type=click.Choice(['cards', 'divination'], case_sensitive=False))
-def show(what):
+@click.argument('what', type=click.Choice(['cards', 'divination', 'decks'], case_sensitive=False))
+@click.option('--archived', is_flag=True, help='Show archived cards instead of the cards in the deck')
+@click.pass_obj
+def show(obj, what, archived):
     """Display information about your cards or divination history
     
     Choose between two options:
     - cards: Show all task cards in your deck box, including status, level, and details
     - divination: Show the results of your most recent card divination session
+    - decks: Show the names of all your decks
+    
+    Completed cards are moved to the archive after a while (30 days by default,
+    configurable with DECK_BOX_ARCHIVE_DAYS); use --archived to show them.
     
     Example: deck-box show cards
-    Example: deck-box show divination
+    Example: deck-box show cards --archived
+    Example: deck-box --deck work show divination
     """
-    storage = Storage()
+    if what == 'decks':
+        click.echo(f"{Fore.BLUE}🗂️  所有卡组:{Style.RESET_ALL}")
+        for deck in Storage.list_decks():
+            marker = "👉" if deck == obj['deck'] else "  "
+            click.echo(f"{marker} {deck}")
+        return
     
-    if what == 'cards':
-        # Display all cards
+    _require_deck(obj)
+    storage = Storage(obj['deck'])
+    
+    if what == 'cards' and archived:
+        # Stream archived cards straight from the archive
+        click.echo(f"{Fore.BLUE}🗄️  已归档卡片:{Style.RESET_ALL}")
+        click.echo(f"{Fore.CYAN}────────────────────────────────────────────────────────────────────{Style.RESET_ALL}")
+        count = 0
+        for card in storage.iter_archived_cards():
+            _echo_card(card)
+            count += 1
+        if not count:
+            click.echo(f"{Fore.YELLOW}🗄️  还没有已归档的卡片！{Style.RESET_ALL}")
+    
+    elif what == 'cards':
+        # Display all cards, including the current cards of recurring templates
+        storage.materialize_templates()
         cards = storage.load_cards()
         if not cards:
             click.echo(f"{Fore.YELLOW}📦 卡盒中还没有卡片！{Style.RESET_ALL}")
@@ -147,26 +364,7 @@ def show(what):
         click.echo(f"{Fore.CYAN}────────────────────────────────────────────────────────────────────{Style.RESET_ALL}")
         
         for card in cards:
-            status_color = Fore.GREEN if card.status == CardStatus.COMPLETED else Fore.RED
-            status_icon = "✅" if card.status == CardStatus.COMPLETED else "⏳"
-            
-            level_color = {
-                1: Fore.GREEN,
-                2: Fore.BLUE,
-                3: Fore.YELLOW,
-                4: Fore.RED
-            }[card.level]
-            
-            click.echo(f"{status_icon} {Fore.WHITE}{card.name}{Style.RESET_ALL}")
-            click.echo(f"   ID: {card.id}")
-            click.echo(f"   {status_color}状态: {card.status.value}{Style.RESET_ALL}")
-            click.echo(f"   {level_color}级别: {card.level}{Style.RESET_ALL} | 预计时间: {card.estimated_time}分钟")
-            if card.actual_time:
-                click.echo(f"   实际时间: {card.actual_time}分钟")
-            click.echo(f"   标签: {card.tag if card.tag else '无'}")
-            if card.predecessor_id:
-                click.echo(f"   前置卡片: {card.predecessor_id}")
-            click.echo(f"{Fore.CYAN}────────────────────────────────────────────────────────────────────{Style.RESET_ALL}")
+            _echo_card(card)
     
     elif what == 'divination':
         # Display latest divination result
@@ -200,7 +398,8 @@ def show(what):
 @click.option('--mood', '-m', type=click.Choice([m.value for m in Mood], case_sensitive=False), required=True, help='How you felt after completing the task (good, average, bad)')
 @click.option('--actual-time', '-t', type=int, required=True, help='Actual time taken to complete the task (in minutes)')
 @click.option('--quality', '-q', type=click.Choice([q.value for q in Quality], case_sensitive=False), required=True, help='Quality of the completed work (excellent, good, average, poor)')
-def complete(card_id, mood, actual_time, quality):
+@click.pass_obj
+def complete(obj, card_id, mood, actual_time, quality):
     """Mark a task card as completed and record your experience
     
     Update a task card's status to completed and provide feedback about your experience:
@@ -208,11 +407,18 @@ def complete(card_id, mood, actual_time, quality):
     - Actual Time: The real time it took (may differ from estimate)
     - Quality: How well you think you completed the task
     
+    The card can be given by its full ID or any unique prefix of it.
+    
     Example: deck-box complete card_123 --mood good --actual-time 15 --quality excellent
+    Example: deck-box complete 7be1 --mood good --actual-time 15 --quality excellent
     """
-    storage = Storage()
+    _require_deck(obj)
+    storage = Storage(obj['deck'])
     
-    # Find card
+    # Find card (a unique prefix of the ID is enough)
+    card_id = _resolve_card_id(storage, card_id)
+    if not card_id:
+        return
     card = storage.get_card_by_id(card_id)
     if not card:
         click.echo(f"{Fore.RED}❌ 卡片ID不存在！{Style.RESET_ALL}")
@@ -228,12 +434,7 @@ def complete(card_id, mood, actual_time, quality):
     card.complete(mood_enum, actual_time, quality_enum)
     
     # Update card
-    cards = storage.load_cards()
-    for i, c in enumerate(cards):
-        if c.id == card.id:
-            cards[i] = card
-            break
-    storage.save_cards(cards)
+    storage.update_card(card)
     
     # Display completion result
     click.echo(f"\n{Fore.GREEN}✅ 成功完成卡片！{Style.RESET_ALL}")
@@ -247,20 +448,29 @@ def complete(card_id, mood, actual_time, quality):
 @cli.command()
 @click.argument('card_id')
 @click.option('-t', '--task', help='New task content (optional)')
-@click.option('-p', '--predecessor', help='New predecessor card ID (optional)')
+@click.option('-p', '--predecessor', help='New predecessor card ID or unique ID prefix (optional)')
 @click.option('--completed/--not-completed', default=None, help='Mark card as completed or not completed (optional)')
-def modify(card_id, task, predecessor, completed):
+@click.option('--due', callback=_parse_due, help='New due date, e.g. 2024-06-30 or "2024-06-30 18:00" (optional, \'\' clears it)')
+@click.option('--priority', type=click.IntRange(0, 5), help='New priority from 1 (lowest) to 5 (highest) (optional, 0 clears it)')
+@click.pass_obj
+def modify(obj, card_id, task, predecessor, completed, due, priority):
     """Modify an existing card.
     
     This command allows you to update the task content, predecessor, or completion status of an existing card.
-    Only the specified fields will be updated.
+    Only the specified fields will be updated. Cards can be given by their full ID
+    or any unique prefix of it.
     
     Example:
         deck-box modify 123 -t "New task description" --completed
         deck-box modify 456 -p 789
         deck-box modify 789 -p ''  # Clear predecessor
+        deck-box modify 789 --due 2024-06-30 --priority 5
     """
-    storage = Storage()
+    _require_deck(obj)
+    storage = Storage(obj['deck'])
+    card_id = _resolve_card_id(storage, card_id)
+    if not card_id:
+        return
     card = storage.get_card_by_id(card_id)
     if not card:
         click.echo(f"{Fore.RED}❌ 卡片ID不存在！{Style.RESET_ALL}")
@@ -272,6 +482,8 @@ def modify(card_id, task, predecessor, completed):
     click.echo(f"Task: {card.name}")
     click.echo(f"Level: {card.level}")
     click.echo(f"Predecessor: {card.predecessor_id or 'None'}")
+    click.echo(f"Due at: {card.due_at.strftime('%Y-%m-%d %H:%M') if card.due_at else 'None'}")
+    click.echo(f"Priority: {card.priority or 'None'}")
     click.echo(f"Completed: {card.status == CardStatus.COMPLETED}")
     click.echo(f"Created at: {card.created_at.strftime('%Y-%m-%d %H:%M:%S')}")
     click.echo(f"Completed at: {card.completed_at.strftime('%Y-%m-%d %H:%M:%S') if card.completed_at else 'None'}")
@@ -290,13 +502,24 @@ def modify(card_id, task, predecessor, completed):
             card.predecessor_id = None
         else:
             # Check if predecessor card exists
-            predecessor_card = storage.get_card_by_id(predecessor)
-            if not predecessor_card:
+            predecessor = _resolve_card_id(storage, predecessor)
+            if not predecessor:
+                return
+            if not storage.get_card_by_id(predecessor) and not storage.is_archived(predecessor):
                 click.echo(f"{Fore.RED}❌ 前置卡片ID不存在！{Style.RESET_ALL}")
                 return
             card.predecessor_id = predecessor
         updated = True
     
+    if due is not None:
+        # Allow clearing the due date with an empty string
+        card.due_at = due or None
+        updated = True
+    
+    if priority is not None:
+        card.priority = priority or None
+        updated = True
+    
     if completed is not None:
         if completed and card.status != CardStatus.COMPLETED:
             # Mark as completed with default values
@@ -316,12 +539,7 @@ def modify(card_id, task, predecessor, completed):
         return
     
     # Update card in storage
-    cards = storage.load_cards()
-    for i, c in enumerate(cards):
-        if c.id == card.id:
-            cards[i] = card
-            break
-    storage.save_cards(cards)
+    storage.update_card(card)
     
     click.echo(f"{Fore.GREEN}✅ 卡片更新成功！{Style.RESET_ALL}")
     click.echo("Updated card information:")
@@ -329,19 +547,27 @@ def modify(card_id, task, predecessor, completed):
     click.echo(f"Task: {card.name}")
     click.echo(f"Level: {card.level}")
     click.echo(f"Predecessor: {card.predecessor_id or 'None'}")
+    click.echo(f"Due at: {card.due_at.strftime('%Y-%m-%d %H:%M') if card.due_at else 'None'}")
+    click.echo(f"Priority: {card.priority or 'None'}")
     click.echo(f"Completed: {card.status == CardStatus.COMPLETED}")
 
 @cli.command()
 @click.argument('card_id')
-def delete(card_id):
+@click.pass_obj
+def delete(obj, card_id):
     """Delete an existing card.
     
-    This command permanently removes a card from the deck.
+    This command permanently removes a card from the deck. The card can be given
+    by its full ID or any unique prefix of it.
     
     Example:
         deck-box delete 123
     """
-    storage = Storage()
+    _require_deck(obj)
+    storage = Storage(obj['deck'])
+    card_id = _resolve_card_id(storage, card_id)
+    if not card_id:
+        return
     card = storage.get_card_by_id(card_id)
     if not card:
         click.echo(f"{Fore.RED}❌ 卡片ID不存在！{Style.RESET_ALL}")
@@ -358,12 +584,269 @@ def delete(card_id):
     # Confirm deletion
     if click.confirm("Are you sure you want to delete this card? This action cannot be undone."):
         # Delete card from storage
-        cards = storage.load_cards()
-        cards = [c for c in cards if c.id != card_id]
-        storage.save_cards(cards)
+        storage.delete_card(card.id)
         click.echo(f"{Fore.GREEN}✅ 卡片已删除！{Style.RESET_ALL}")
     else:
         click.echo(f"{Fore.YELLOW}⚠️  删除已取消！{Style.RESET_ALL}")
 
+@cli.command()
+@click.pass_obj
+def session(obj):
+    """Start an interactive work session
+    
+    The deck is loaded once and kept in memory, so drawing and completing cards
+    inside the session is instant. Changes are saved in the background and
+    written out completely when you leave the session.
+    
+    Commands inside the session: draw [min] [max], single, urgent [min] [max],
+    show [available], complete <#n|id> [mood] [actual_time] [quality], quit
+    
+    Example: deck-box session
+    """
+    from .session import Session, SessionShell
+    
+    _require_deck(obj)
+    work_session = Session(obj['deck'])
+    try:
+        SessionShell(work_session).cmdloop()
+    except KeyboardInterrupt:
+        click.echo()
+    finally:
+        work_session.close()
+    
+    if work_session.writer.errors:
+        click.echo(f"{Fore.RED}❌ 保存时出错: {work_session.writer.errors[0]}{Style.RESET_ALL}")
+    else:
+        click.echo(f"{Fore.GREEN}✅ 所有更改已保存！{Style.RESET_ALL}")
+
+@cli.command()
+@click.argument('query')
+@click.option('--limit', '-l', type=int, default=20, show_default=True, help='Maximum number of cards to show')
+@click.pass_obj
+def search(obj, query, limit):
+    """Search cards by name, description or tag
+    
+    All words of the query must match. Chinese text is matched by its
+    characters, so partial names work too.
+    
+    Example: deck-box search 项目文档
+    Example: deck-box search "report work"
+    """
+    _require_deck(obj)
+    storage = Storage(obj['deck'])
+    cards = storage.search_cards(query, limit)
+    if not cards:
+        click.echo(f"{Fore.YELLOW}🔍 没有找到匹配的卡片！{Style.RESET_ALL}")
+        return
+    
+    click.echo(f"{Fore.BLUE}🔍 搜索结果 ({len(cards)}):{Style.RESET_ALL}")
+    click.echo(f"{Fore.CYAN}────────────────────────────────────────────────────────────────────{Style.RESET_ALL}")
+    for card in cards:
+        _echo_card(card)
+
+@cli.command()
+@click.option('--days', type=int, help='Archive cards completed at least this many days ago (default: DECK_BOX_ARCHIVE_DAYS or 30)')
+@click.pass_obj
+def archive(obj, days):
+    """Move old completed cards to the archive
+    
+    Completed cards are archived automatically the first time the deck is
+    changed after they got older than the configured age. This command runs
+    the archival right away, optionally with a different age. Archived cards still count as completed predecessors.
+    
+    Example: deck-box archive --days 7
+    """
+    _require_deck(obj)
+    storage = Storage(obj['deck'], archive_after_days=days)
+    before = len(storage.archived_ids())
+    storage.compact()
+    click.echo(f"{Fore.GREEN}✅ 已归档 {len(storage.archived_ids()) - before} 张卡片！{Style.RESET_ALL}")
+
+@cli.command()
+@click.pass_obj
+def stats(obj):
+    """Show statistics about your cards, including archived ones
+    
+    Example: deck-box stats
+    """
+    _require_deck(obj)
+    storage = Storage(obj['deck'])
+    
+    pending = 0
+    completed = 0
+    estimated_total = 0
+    actual_total = 0
+    moods = {mood: 0 for mood in Mood}
+    qualities = {quality: 0 for quality in Quality}
+    
+    # The archive is streamed so it is never held in memory at once
+    for card in itertools.chain(storage.load_cards(), storage.iter_archived_cards()):
+        if card.status != CardStatus.COMPLETED:
+            pending += 1
+            continue
+        completed += 1
+        estimated_total += card.estimated_time
+        actual_total += card.actual_time or 0
+        if card.mood:
+            moods[card.mood] += 1
+        if card.quality:
+            qualities[card.quality] += 1
+    
+    click.echo(f"{Fore.BLUE}📊 卡片统计:{Style.RESET_ALL}")
+    click.echo(f"   待完成: {pending} | 已完成: {completed}")
+    if completed:
+        click.echo(f"   平均预计时间: {estimated_total / completed:.1f}分钟 | 平均实际时间: {actual_total / completed:.1f}分钟")
+        click.echo(f"   心情: " + ", ".join(f"{mood.value} {count}" for mood, count in moods.items()))
+        click.echo(f"   质量: " + ", ".join(f"{quality.value} {count}" for quality, count in qualities.items()))
+
+def _echo_rollups(title, rollups, open_counts, label=str):
+    """Display the conversion rollups of a group of draws, one row per key"""
+    click.echo(f"\n{Fore.BLUE}{title}{Style.RESET_ALL}")
+    for key in sorted(rollups, key=str):
+        rollup = rollups[key]
+        rate = f"{rollup.conversion_rate:6.1%}" if rollup.conversion_rate is not None else "     -"
+        mean = f"{rollup.mean_hours:.1f}小时" if rollup.mean_hours is not None else "-"
+        click.echo(f"   {label(key):>10} | 抽到: {rollup.draws:>5} | 完成率: {rate} | 放弃: {rollup.abandoned:>5} | "
+                   f"进行中: {open_counts[key]:>3} | 平均完成用时: {mean}")
+
+@cli.command()
+@click.option('--days', type=click.IntRange(min=1), default=ABANDON_AFTER_DAYS, show_default=True, help='Drawn cards not completed within this many days count as abandoned')
+@click.pass_obj
+def analytics(obj, days):
+    """Show how often drawn cards get completed, and how fast
+    
+    Every draw is matched with the completion of its card. Draws that are not
+    completed within --days days, or that are drawn again first, count as
+    abandoned. Results are shown by level and by tag. Only the history logged
+    since the last run is read, so this stays fast after years of use.
+    
+    Example: deck-box analytics
+    Example: deck-box analytics --days 3
+    """
+    from .analytics import TIME_BUCKETS
+    
+    _require_deck(obj)
+    history = Storage(obj['deck']).history_analytics(days)
+    if not history.levels:
+        click.echo(f"{Fore.YELLOW}🔮 还没有占卜记录！{Style.RESET_ALL}")
+        return
+    
+    open_levels, open_tags = history.open_counts()
+    _echo_rollups("📶 按级别:", history.levels, open_levels, lambda level: f"级别 {level}")
+    _echo_rollups("🏷️  按标签:", history.tags, open_tags, lambda tag: tag or "无")
+    
+    time_buckets = sum((rollup.time_buckets for rollup in history.levels.values()), Counter())
+    _echo_histogram(
+        "⏱️  完成用时 (小时):", time_buckets,
+        lambda bound: f"≤ {bound}" if bound in TIME_BUCKETS else f"> {TIME_BUCKETS[-1]}"
+    )
+
+@cli.command()
+@click.option('--repair', is_flag=True, help='Repair the problems found (damaged records are dropped)')
+@click.pass_obj
+def fsck(obj, repair):
+    """Check the data files of a deck for damage and inconsistencies
+    
+    Reads the data files record by record, so damaged files are checked too,
+    and reports unreadable records, duplicate card IDs, predecessors that do
+    not exist or depend on each other in a cycle, and levels that do not match
+    the estimated time. With --repair, the readable records are kept, dangling
+    and cyclic predecessors are cleared and levels are recalculated.
+    
+    Example: deck-box fsck
+    Example: deck-box --deck work fsck --repair
+    """
+    from .fsck import PROBLEMS, DeckChecker
+    
+    _require_deck(obj)
+    report = DeckChecker(obj['deck']).check(repair)
+    click.echo(f"{Fore.BLUE}🩺 已检查 {report.cards} 张卡片{Style.RESET_ALL}")
+    if report.clean:
+        click.echo(f"{Fore.GREEN}✅ 没有发现问题！{Style.RESET_ALL}")
+        return
+    
+    for name, count in report.damaged.items():
+        click.echo(f"{Fore.RED}❌ {name}: {count} 条记录已损坏{Style.RESET_ALL}")
+    for kind, count in report.problems.items():
+        click.echo(f"{Fore.YELLOW}⚠️  {PROBLEMS[kind]}: {count} 张卡片{Style.RESET_ALL}")
+        for card_id in report.examples[kind]:
+            click.echo(f"   {card_id}")
+        if count > len(report.examples[kind]):
+            click.echo(f"   ...")
+    
+    if report.repaired:
+        click.echo(f"{Fore.GREEN}✅ 已修复！损坏的记录已丢弃。{Style.RESET_ALL}")
+    else:
+        click.echo(f"{Fore.YELLOW}💡 提示：使用 'deck-box fsck --repair' 修复这些问题{Style.RESET_ALL}")
+
+@cli.group()
+def template():
+    """Manage recurring card templates
+    
+    A template adds a fresh card for every occurrence of its schedule, e.g.
+    every day or every two weeks. Cards are only created when a divination or
+    'show cards' needs them, one for the current occurrence, and are due when
+    the next occurrence starts. Missed occurrences are skipped.
+    
+    Example: deck-box template add --name "Water the plants" --time 5 --every daily
+    Example: deck-box template add --name "Weekly review" --time 30 --every weekly --interval 2
+    """
+
+@template.command('add')
+@click.option('--name', '-n', required=True, help='The name/title of the cards')
+@click.option('--time', '-t', type=int, required=True, help='Estimated time needed to complete each card (in minutes)')
+@click.option('--every', '-e', 'frequency', type=click.Choice([f.value for f in Frequency], case_sensitive=False), default=Frequency.DAILY.value, show_default=True, help='How often a card is created')
+@click.option('--interval', '-i', type=click.IntRange(min=1), default=1, show_default=True, help='Create a card every INTERVAL days/weeks/months')
+@click.option('--start', type=click.DateTime(DUE_DATE_FORMATS), help='When the schedule starts (default: today)')
+@click.option('--tag', '-g', help='Optional tag of the cards')
+@click.option('--description', '-d', help='Optional detailed description of the cards')
+@click.option('--priority', type=click.IntRange(1, 5), help='Optional priority of the cards from 1 (lowest) to 5 (highest)')
+@click.pass_obj
+def template_add(obj, name, time, frequency, interval, start, tag, description, priority):
+    """Add a recurring card template"""
+    storage = Storage(obj['deck'])
+    new_template = Template(name, time, Frequency(frequency.lower()), interval, tag, description, priority, start)
+    storage.add_template(new_template)
+    
+    click.echo(f"\n{Fore.GREEN}✅ 成功添加循环模板！{Style.RESET_ALL}")
+    click.echo(f"   ID: {new_template.id}")
+    click.echo(f"   名称: {new_template.name}")
+    click.echo(f"   频率: 每 {new_template.interval} {new_template.frequency.value}")
+    click.echo(f"   开始时间: {new_template.start_at.strftime('%Y-%m-%d %H:%M')}")
+
+@template.command('list')
+@click.pass_obj
+def template_list(obj):
+    """Show all recurring card templates"""
+    _require_deck(obj)
+    templates = Storage(obj['deck']).load_templates()
+    if not templates:
+        click.echo(f"{Fore.YELLOW}🔁 还没有循环模板！{Style.RESET_ALL}")
+        return
+    
+    click.echo(f"{Fore.BLUE}🔁 循环模板 ({len(templates)}):{Style.RESET_ALL}")
+    for item in templates:
+        click.echo(f"   {Fore.WHITE}{item.name}{Style.RESET_ALL} | 每 {item.interval} {item.frequency.value} | "
+                   f"时长: {item.estimated_time}分钟 | 标签: {item.tag if item.tag else '无'} | ID: {item.id[:8]}")
+
+@template.command('delete')
+@click.argument('template_id')
+@click.pass_obj
+def template_delete(obj, template_id):
+    """Delete a recurring card template (cards it already created are kept)
+    
+    The template can be given by its full ID or any unique prefix of it.
+    """
+    _require_deck(obj)
+    storage = Storage(obj['deck'])
+    matches = [item for item in storage.load_templates() if item.id.startswith(template_id)]
+    if len(matches) > 1:
+        click.echo(f"{Fore.RED}❌ 模板ID前缀 '{template_id}' 匹配多个模板，请输入更多位！{Style.RESET_ALL}")
+        return
+    if not matches or not storage.delete_template(matches[0].id):
+        click.echo(f"{Fore.RED}❌ 模板ID不存在！{Style.RESET_ALL}")
+        return
+    click.echo(f"{Fore.GREEN}✅ 模板 '{matches[0].name}' 已删除！{Style.RESET_ALL}")
+
 if __name__ == '__main__':
     cli()
\ No newline at end of file
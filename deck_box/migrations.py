@@ -0,0 +1,189 @@
+import gzip
+import json
+import os
+import re
+import uuid
+from datetime import datetime
+from .models import Card
+
+# Data files written before versioning are plain JSON arrays, which is version 1.
+# Versioned files start with a header line naming the version, so checking the
+# version only ever reads the first bytes of a file.
+VERSION_HEADER_PATTERN = re.compile(rb'\s*\{\s*"version"\s*:\s*(\d+)')
+
+# Number of characters read at a time when streaming JSON arrays
+READ_CHUNK_SIZE = 65536
+
+def _card_v1_to_v2(data):
+    """Fill in the fields that version 1 cards could be missing"""
+    data.setdefault("id", str(uuid.uuid4()))
+    for key in ("description", "actual_time", "tag", "completed_at", "mood", "quality", "predecessor_id"):
+        data.setdefault(key, None)
+    data.setdefault("status", "pending")
+    data.setdefault("created_at", datetime.now().isoformat())
+    data.setdefault("level", Card.level_for_time(data["estimated_time"]))
+    return data
+
+def _card_v2_to_v3(data):
+    """Add the due date and priority fields introduced in version 3"""
+    data.setdefault("due_at", None)
+    data.setdefault("priority", None)
+    return data
+
+def _divination_v1_to_v2(data):
+    """Fill in the fields that version 1 divination results could be missing"""
+    data.setdefault("id", str(uuid.uuid4()))
+    data.setdefault("total_time", sum(card["estimated_time"] for card in data["cards"]))
+    return data
+
+# Upgrade steps; the step at index i upgrades a record from version i + 1 to
+# version i + 2. Steps must be idempotent, so re-running an interrupted
+# migration never damages records that were already upgraded. Divination
+# results only need their own steps where more than their card snapshots changed.
+CARD_UPGRADES = [_card_v1_to_v2, _card_v2_to_v3]
+DIVINATION_UPGRADES = [_divination_v1_to_v2]
+
+SCHEMA_VERSION = len(CARD_UPGRADES) + 1
+
+def upgrade_card(data, version):
+    """Upgrade a card dictionary from `version` to the current version"""
+    for step in CARD_UPGRADES[version - 1:]:
+        data = step(data)
+    return data
+
+def upgrade_journal_entry(entry, version):
+    """Upgrade the card of a journal entry from `version` to the current version"""
+    if entry.get("op") == "put":
+        entry["card"] = upgrade_card(entry["card"], version)
+    return entry
+
+def upgrade_divination(data, version):
+    """Upgrade a divination result dictionary (and its card snapshots) from `version` to the current version"""
+    data["cards"] = [upgrade_card(card, version) for card in data.get("cards", [])]
+    for step in DIVINATION_UPGRADES[version - 1:]:
+        data = step(data)
+    return data
+
+def file_header(key, version=SCHEMA_VERSION):
+    """Get the first line of a versioned data file holding a `key` array"""
+    return f'{{"version": {version}, "{key}": ['
+
+def read_version(path):
+    """Read the version of a data file from its first bytes"""
+    with open(path, "rb") as f:
+        head = f.read(64)
+    match = VERSION_HEADER_PATTERN.match(head)
+    if match:
+        return int(match.group(1))
+    if head.lstrip().startswith(b"["):
+        return 1
+    raise ValueError(f"Unrecognized data file format: {path}")
+
+def iter_json_array(f):
+    """Stream the items of the first JSON array in a text file
+
+    Only one item is held in memory at a time, so arbitrarily large files can
+    be processed in constant memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    while "[" not in buffer:
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            raise ValueError("No JSON array found")
+        buffer += chunk
+    buffer = buffer[buffer.index("[") + 1:]
+
+    while True:
+        buffer = buffer.lstrip(" \t\r\n,")
+        if buffer.startswith("]"):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer) if buffer else (None, 0)
+        except json.JSONDecodeError:
+            end = 0
+        if not end:
+            # The item continues beyond the buffer
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                raise ValueError("Unexpected end of JSON array")
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+def migrate_array_file(path, key, upgrade):
+    """Upgrade a data file holding a JSON array of records to the current version
+
+    Records are streamed one at a time into a temporary file, which replaces
+    the original once complete. If the migration is interrupted it resumes
+    from the records already in the temporary file. Returns True if the file
+    was migrated, False if it was already current.
+    """
+    version = read_version(path)
+    if version >= SCHEMA_VERSION:
+        return False
+
+    tmp_path = path.with_name(path.name + ".migrating")
+    done, resume_offset = _migrated_records(tmp_path) if tmp_path.exists() else (0, None)
+
+    with open(path, "r", encoding="utf-8") as source, open(tmp_path, "wb" if resume_offset is None else "r+b") as target:
+        if resume_offset is None:
+            target.write(file_header(key).encode("utf-8"))
+        else:
+            target.seek(resume_offset)
+            target.truncate()
+        # The first array in both unversioned and versioned files holds the records
+        records = iter_json_array(source)
+        for index, data in enumerate(records):
+            if index < done:
+                continue
+            separator = b",\n" if index else b"\n"
+            target.write(separator + json.dumps(upgrade(data, version), ensure_ascii=False).encode("utf-8"))
+        target.write(b"\n]}\n")
+        target.flush()
+        os.fsync(target.fileno())
+    os.replace(tmp_path, path)
+    return True
+
+def migrate_lines_file(path, upgrade, version, compressed=False):
+    """Upgrade a JSON lines file record by record (used for the journal and the archive)
+
+    These files carry no version of their own; they always have the version of
+    the deck's cards file, which is migrated after them.
+    """
+    if not path.exists():
+        return
+    opener = gzip.open if compressed else open
+    tmp_path = path.with_name(path.name + ".migrating")
+    with opener(path, "rt", encoding="utf-8") as source, opener(tmp_path, "wt", encoding="utf-8") as target:
+        for line in source:
+            if line.strip():
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    # An interrupted append; it was never valid
+                    continue
+                target.write(json.dumps(upgrade(data, version), ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+
+def _migrated_records(tmp_path):
+    """Count the complete records of an interrupted migration and find where the last one ends"""
+    with open(tmp_path, "rb") as f:
+        header = f.readline()
+        if not header.startswith(b'{"version"'):
+            return 0, None
+        done = 0
+        end = len(header.rstrip(b"\n"))
+        position = len(header)
+        # Records are written as "\n{...}" or ",\n{...}", so every line holds one record
+        for line in f:
+            record = line.rstrip(b"\n").rstrip(b",")
+            try:
+                json.loads(record)
+            except ValueError:
+                break
+            done += 1
+            end = position + len(record)
+            position += len(line)
+    return done, end
@@ -1,7 +1,12 @@
+import calendar
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
 
+# Namespace of the IDs of cards created from templates, which are derived from
+# the template ID and occurrence so every occurrence has exactly one card
+TEMPLATE_NAMESPACE = uuid.UUID("6f1d3a52-9c1e-4b8e-a7c4-2d5e8b0f4a61")
+
 class CardStatus(Enum):
     PENDING = "pending"
     COMPLETED = "completed"
@@ -19,8 +24,13 @@ class Quality(Enum):
     MEDIUM = "medium"
     POOR = "poor"
 
+class Frequency(Enum):
+    DAILY = "daily"
+    WEEKLY = "weekly"
+    MONTHLY = "monthly"
+
 class Card:
-    def __init__(self, name, estimated_time, tag=None, description=None, predecessor_id=None):
+    def __init__(self, name, estimated_time, tag=None, description=None, predecessor_id=None, due_at=None, priority=None):
         self.id = str(uuid.uuid4())
         self.name = name
         self.description = description
@@ -34,14 +44,21 @@ class Card:
         self.mood = None
         self.quality = None
         self.predecessor_id = predecessor_id
+        self.due_at = due_at
+        self.priority = priority
 
     def _calculate_level(self):
         """Calculate card level based on estimated time"""
-        if self.estimated_time <= 15:
+        return self.level_for_time(self.estimated_time)
+
+    @staticmethod
+    def level_for_time(estimated_time):
+        """Get the level of a card with the given estimated time"""
+        if estimated_time <= 15:
             return 1
-        elif self.estimated_time <= 30:
+        elif estimated_time <= 30:
             return 2
-        elif self.estimated_time <= 60:
+        elif estimated_time <= 60:
             return 3
         else:
             return 4
@@ -69,7 +86,9 @@ class Card:
             "completed_at": self.completed_at.isoformat() if self.completed_at else None,
             "mood": self.mood.value if self.mood else None,
             "quality": self.quality.value if self.quality else None,
-            "predecessor_id": self.predecessor_id
+            "predecessor_id": self.predecessor_id,
+            "due_at": self.due_at.isoformat() if self.due_at else None,
+            "priority": self.priority
         }
 
     @classmethod
@@ -80,7 +99,9 @@ class Card:
             estimated_time=data["estimated_time"],
             tag=data.get("tag"),
             description=data.get("description"),
-            predecessor_id=data.get("predecessor_id")
+            predecessor_id=data.get("predecessor_id"),
+            due_at=datetime.fromisoformat(data["due_at"]) if data.get("due_at") else None,
+            priority=data.get("priority")
         )
         card.id = data["id"]
         card.actual_time = data.get("actual_time")
@@ -115,4 +136,89 @@ class DivinationResult:
         result = cls(cards)
         result.id = data["id"]
         result.created_at = datetime.fromisoformat(data["created_at"])
-        return result
\ No newline at end of file
+        return result
+
+class Template:
+    """Recurring card template, creating one card per occurrence of its schedule"""
+    def __init__(self, name, estimated_time, frequency=Frequency.DAILY, interval=1, tag=None, description=None, priority=None, start_at=None):
+        self.id = str(uuid.uuid4())
+        self.name = name
+        self.description = description
+        self.estimated_time = estimated_time
+        self.tag = tag
+        self.priority = priority
+        self.frequency = frequency
+        self.interval = interval
+        self.start_at = start_at or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.created_at = datetime.now()
+        self.last_occurrence = None
+
+    def occurrence_start(self, occurrence):
+        """Get the start of an occurrence (counting from 0 at `start_at`)"""
+        if self.frequency == Frequency.MONTHLY:
+            return _add_months(self.start_at, occurrence * self.interval)
+        days = 7 if self.frequency == Frequency.WEEKLY else 1
+        return self.start_at + timedelta(days=days * self.interval * occurrence)
+
+    def occurrence_at(self, moment):
+        """Get the occurrence whose window contains `moment`, or None before the schedule starts"""
+        if moment < self.start_at:
+            return None
+        if self.frequency == Frequency.MONTHLY:
+            months = (moment.year - self.start_at.year) * 12 + moment.month - self.start_at.month
+            occurrence = months // self.interval
+            # The day of the month may not have been reached yet
+            if self.occurrence_start(occurrence) > moment:
+                occurrence -= 1
+            return occurrence
+        return (moment - self.start_at) // (self.occurrence_start(1) - self.start_at)
+
+    def instance(self, occurrence):
+        """Create the card of an occurrence, due when the next occurrence starts"""
+        card = Card(
+            self.name, self.estimated_time, self.tag, self.description,
+            due_at=self.occurrence_start(occurrence + 1), priority=self.priority
+        )
+        card.id = str(uuid.uuid5(TEMPLATE_NAMESPACE, f"{self.id}/{occurrence}"))
+        return card
+
+    def to_dict(self):
+        """Convert to dictionary format for storage"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "estimated_time": self.estimated_time,
+            "tag": self.tag,
+            "priority": self.priority,
+            "frequency": self.frequency.value,
+            "interval": self.interval,
+            "start_at": self.start_at.isoformat(),
+            "created_at": self.created_at.isoformat(),
+            "last_occurrence": self.last_occurrence
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Create a Template instance from a dictionary"""
+        template = cls(
+            name=data["name"],
+            estimated_time=data["estimated_time"],
+            frequency=Frequency(data["frequency"]),
+            interval=data["interval"],
+            tag=data.get("tag"),
+            description=data.get("description"),
+            priority=data.get("priority"),
+            start_at=datetime.fromisoformat(data["start_at"])
+        )
+        template.id = data["id"]
+        template.created_at = datetime.fromisoformat(data["created_at"])
+        template.last_occurrence = data["last_occurrence"]
+        return template
+
+def _add_months(moment, months):
+    """Add months to a datetime, clamping the day to the length of the target month"""
+    month = moment.month - 1 + months
+    year = moment.year + month // 12
+    month = month % 12 + 1
+    return moment.replace(year=year, month=month, day=min(moment.day, calendar.monthrange(year, month)[1]))
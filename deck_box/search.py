@@ -0,0 +1,119 @@
+import re
+import sqlite3
+from contextlib import closing
+
+# Ideographs, kana and hangul are not separated by spaces, so they are indexed
+# as single characters and character bigrams instead of words
+CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+TOKEN_PATTERN = re.compile(rf"([{CJK_CHARS}]+)|([^\W_{CJK_CHARS}]+)")
+
+SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS terms (term TEXT NOT NULL, id TEXT NOT NULL, PRIMARY KEY (term, id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS terms_by_id ON terms (id);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+def tokenize(text):
+    """Split text into index terms: lowercase words, CJK characters and CJK bigrams"""
+    terms = []
+    for cjk, word in TOKEN_PATTERN.findall((text or "").lower()):
+        if cjk:
+            terms.extend(cjk)
+            terms.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            terms.append(word)
+    return list(dict.fromkeys(terms))
+
+def tokenize_query(query):
+    """Split a search query into (term, is_prefix) pairs
+
+    CJK text is matched by its bigrams (or the character itself if it stands
+    alone), words are matched as prefixes so partially typed words still match.
+    """
+    terms = []
+    for cjk, word in TOKEN_PATTERN.findall((query or "").lower()):
+        if len(cjk) == 1:
+            terms.append((cjk, False))
+        elif cjk:
+            terms.extend((cjk[i:i + 2], False) for i in range(len(cjk) - 1))
+        else:
+            terms.append((word, True))
+    return list(dict.fromkeys(terms))
+
+def card_terms(card):
+    """Get the index terms of a card"""
+    return tokenize(" ".join(filter(None, [card.name, card.description, card.tag])))
+
+def prefix_upper_bound(prefix):
+    """Get the smallest string greater than every string starting with `prefix`"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+class SearchIndex:
+    """Inverted index from terms to card IDs, stored in a sqlite database"""
+    def __init__(self, path):
+        self.path = path
+
+    def is_ready(self):
+        """Check whether the index has been built"""
+        if not self.path.exists():
+            return False
+        with closing(self._connect()) as index:
+            return index.execute("SELECT 1 FROM meta WHERE key = 'ready'").fetchone() is not None
+
+    def rebuild(self, cards):
+        """Build the index from scratch"""
+        self.clear()
+        with closing(self._connect()) as index, index:
+            index.executemany(
+                "INSERT OR IGNORE INTO terms VALUES (?, ?)",
+                ((term, card.id) for card in cards for term in card_terms(card))
+            )
+            index.execute("INSERT OR REPLACE INTO meta VALUES ('ready', '1')")
+
+    def clear(self):
+        """Drop the index; it is rebuilt the next time it is needed"""
+        for path in self.path.parent.glob(self.path.name + "*"):
+            path.unlink()
+
+    def update(self, card):
+        """Index a new or changed card"""
+        if not self.path.exists():
+            return
+        with closing(self._connect()) as index, index:
+            index.execute("DELETE FROM terms WHERE id = ?", (card.id,))
+            index.executemany("INSERT OR IGNORE INTO terms VALUES (?, ?)", ((term, card.id) for term in card_terms(card)))
+
+    def remove(self, card_ids):
+        """Remove cards from the index"""
+        if not self.path.exists():
+            return
+        with closing(self._connect()) as index, index:
+            index.executemany("DELETE FROM terms WHERE id = ?", ((card_id,) for card_id in card_ids))
+
+    def search(self, query, limit=20):
+        """Get the IDs of the cards matching every term of the query"""
+        terms = tokenize_query(query)
+        if not terms:
+            return []
+
+        selects = []
+        params = []
+        for term, is_prefix in terms:
+            if is_prefix:
+                selects.append("SELECT id FROM terms WHERE term >= ? AND term < ?")
+                params.extend([term, prefix_upper_bound(term)])
+            else:
+                selects.append("SELECT id FROM terms WHERE term = ?")
+                params.append(term)
+
+        with closing(self._connect()) as index:
+            rows = index.execute(" INTERSECT ".join(selects) + " LIMIT ?", params + [limit])
+            return [row[0] for row in rows]
+
+    def _connect(self):
+        """Connect to the index database, creating its tables if needed"""
+        index = sqlite3.connect(self.path)
+        # The index can always be rebuilt from the deck, so skip fsyncs
+        index.execute("PRAGMA synchronous = OFF")
+        index.executescript(SEARCH_SCHEMA)
+        return index
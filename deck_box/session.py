@@ -0,0 +1,222 @@
+import cmd
+import queue
+import threading
+import time
+import click
+from colorama import Fore, Style
+from .divination import AvailabilityIndex, Divination, ReadyQueue
+from .models import CardStatus, DivinationResult, Mood, Quality
+from .storage import DEFAULT_DECK
+
+LEVEL_COLORS = {
+    1: Fore.GREEN,
+    2: Fore.BLUE,
+    3: Fore.YELLOW,
+    4: Fore.RED
+}
+
+class WriteBehind:
+    """Background writer, persisting changes without making the session wait for the disk"""
+    def __init__(self):
+        self.errors = []
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="deck-box-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, function, *args):
+        """Queue a write"""
+        self._queue.put((function, args))
+
+    def flush(self):
+        """Wait until all queued writes are done"""
+        self._queue.join()
+
+    def close(self):
+        """Finish all queued writes and stop the writer"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        """Perform queued writes in order"""
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                function, args = task
+                function(*args)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self._queue.task_done()
+
+class Session:
+    """Work session keeping a deck in memory between actions
+
+    The deck is loaded once; draws and completions work on the in-memory
+    availability index and ready queue, and changes are written to storage in
+    the background.
+    """
+    def __init__(self, deck=DEFAULT_DECK):
+        self.divination = Divination(deck)
+        self.storage = self.divination.storage
+        self.ready_queue = ReadyQueue(level_weights=self.divination.level_weights)
+        self.storage.materialize_templates()
+        self.index = AvailabilityIndex(self.storage.load_cards(), self.storage.is_archived, self.ready_queue)
+        self.drawn = []
+        self.writer = WriteBehind()
+
+    def draw(self, min_time=90, max_time=150, single=False, urgent=False):
+        """Draw cards from the available cards and remember them as the current draw
+        
+        With `urgent` the most urgent cards are taken from the ready queue
+        instead of being drawn at random.
+        """
+        available_cards = self.index.available_cards()
+        if urgent:
+            cards = self.ready_queue.draw(min_time, max_time, 1 if single else 5)
+        elif single:
+            card = self.divination.sampler.select_card(available_cards)
+            cards = [card] if card else None
+        else:
+            cards = self.divination.sampler.draw_combination(available_cards, min_time, max_time)
+        if cards:
+            self.drawn = cards
+            self.writer.submit(self.storage.save_divination, DivinationResult(cards))
+        return cards
+
+    def find_card(self, reference):
+        """Find a card by its number in the current draw (e.g. #2) or by a unique ID prefix
+
+        Returns the card, or a list of the candidates if the reference matches
+        no card or several cards.
+        """
+        if reference.startswith("#") and reference[1:].isdigit():
+            number = int(reference[1:])
+            return self.drawn[number - 1] if 0 < number <= len(self.drawn) else []
+        matches = [card for card_id, card in self.index.cards.items() if card_id.startswith(reference)]
+        return matches[0] if len(matches) == 1 else matches
+
+    def complete(self, card, mood=Mood.GOOD, actual_time=None, quality=Quality.GOOD):
+        """Complete a card, returning the cards that became available because of it"""
+        card.complete(mood, card.estimated_time if actual_time is None else actual_time, quality)
+        self.writer.submit(self.storage.update_card, card)
+        return [changed for changed in self.index.update(card) if changed is not card]
+
+    def close(self):
+        """Write all pending changes to storage"""
+        self.writer.close()
+
+class SessionShell(cmd.Cmd):
+    """Interactive shell of a work session"""
+    intro = f"{Fore.MAGENTA}🧙‍♀️  占卜工作台已就绪！输入 help 查看命令，quit 退出。{Style.RESET_ALL}"
+    prompt = "🔮 > "
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+
+    def onecmd(self, line):
+        """Run a command and report how long it took"""
+        start = time.perf_counter()
+        stop = super().onecmd(line)
+        if line.strip() and not stop:
+            click.echo(f"{Style.DIM}({(time.perf_counter() - start) * 1000:.1f} ms){Style.RESET_ALL}")
+        return stop
+
+    def emptyline(self):
+        """Do nothing on an empty line instead of repeating the last command"""
+
+    def _echo_row(self, number, card):
+        """Display one card as a row"""
+        icon = "✅" if card.status == CardStatus.COMPLETED else "⏳"
+        click.echo(f"   {icon} #{number} {Fore.WHITE}{card.name}{Style.RESET_ALL} "
+                   f"{LEVEL_COLORS[card.level]}级别: {card.level}{Style.RESET_ALL} | 时长: {card.estimated_time}分钟 | "
+                   f"标签: {card.tag if card.tag else '无'} | ID: {card.id[:8]}")
+
+    def do_draw(self, arg):
+        """draw [min] [max]: Draw a combination of cards within the time range (default 90 150)"""
+        try:
+            bounds = [int(value) for value in arg.split()]
+        except ValueError:
+            click.echo(f"{Fore.RED}❌ 时间范围必须是整数！{Style.RESET_ALL}")
+            return
+        cards = self.session.draw(*bounds[:2])
+        self._show_draw(cards)
+
+    def do_single(self, arg):
+        """single: Draw a single card"""
+        self._show_draw(self.session.draw(single=True))
+
+    def do_urgent(self, arg):
+        """urgent [min] [max]: Draw the most urgent cards within the time range (default 90 150)"""
+        try:
+            bounds = [int(value) for value in arg.split()]
+        except ValueError:
+            click.echo(f"{Fore.RED}❌ 时间范围必须是整数！{Style.RESET_ALL}")
+            return
+        self._show_draw(self.session.draw(*bounds[:2], urgent=True))
+
+    def _show_draw(self, cards):
+        """Display a fresh draw"""
+        if not cards:
+            click.echo(f"{Fore.RED}❌ 无法找到合适的卡片组合！{Style.RESET_ALL}")
+            return
+        click.echo(f"{Fore.MAGENTA}🔮 占卜结果：共 {len(cards)} 张卡片，总时长: {sum(card.estimated_time for card in cards)} 分钟{Style.RESET_ALL}")
+        for number, card in enumerate(cards, 1):
+            self._echo_row(number, card)
+
+    def do_show(self, arg):
+        """show [available]: Show the current draw, or all available cards"""
+        if arg.strip() == "available":
+            cards = self.session.index.available_cards()
+            click.echo(f"{Fore.BLUE}📋 可抽取的卡片 ({len(cards)}):{Style.RESET_ALL}")
+            for card in cards:
+                self._echo_row("-", card)
+            return
+        if not self.session.drawn:
+            click.echo(f"{Fore.YELLOW}🔮 还没有进行过占卜！{Style.RESET_ALL}")
+            return
+        for number, card in enumerate(self.session.drawn, 1):
+            self._echo_row(number, card)
+
+    def do_complete(self, arg):
+        """complete <#n|id> [mood] [actual_time] [quality]: Complete a card (defaults: good, estimated time, good)"""
+        args = arg.split()
+        if not args:
+            click.echo(f"{Fore.RED}❌ 请指定卡片编号（如 #1）或ID！{Style.RESET_ALL}")
+            return
+        card = self.session.find_card(args[0])
+        if isinstance(card, list):
+            message = "匹配多张卡片，请输入更多位" if card else "卡片不存在"
+            click.echo(f"{Fore.RED}❌ {message}！{Style.RESET_ALL}")
+            return
+        if card.status == CardStatus.COMPLETED:
+            click.echo(f"{Fore.YELLOW}⚠️  这张卡片已经完成了！{Style.RESET_ALL}")
+            return
+        try:
+            mood = Mood(args[1].lower()) if len(args) > 1 else Mood.GOOD
+            actual_time = int(args[2]) if len(args) > 2 else None
+            quality = Quality(args[3].lower()) if len(args) > 3 else Quality.GOOD
+        except ValueError:
+            click.echo(f"{Fore.RED}❌ 参数无效！心情: {', '.join(m.value for m in Mood)}；质量: {', '.join(q.value for q in Quality)}{Style.RESET_ALL}")
+            return
+
+        unlocked = self.session.complete(card, mood, actual_time, quality)
+
+        # Only redraw the rows that changed
+        number = self.session.drawn.index(card) + 1 if card in self.session.drawn else "-"
+        self._echo_row(number, card)
+        if unlocked:
+            click.echo(f"   {Fore.GREEN}🔓 已解锁:{Style.RESET_ALL}")
+        for unlocked_card in unlocked:
+            self._echo_row("-", unlocked_card)
+
+    def do_quit(self, arg):
+        """quit: Save all changes and leave the session"""
+        return True
+
+    def do_EOF(self, arg):
+        """Leave the session on Ctrl-D"""
+        click.echo()
+        return True
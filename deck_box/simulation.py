@@ -0,0 +1,94 @@
+import os
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .divination import CardSampler
+
+# Number of simulated draws handed to a worker at a time
+CHUNK_SIZE = 250
+
+# Width of the session length histogram buckets (in minutes)
+BUCKET_MINUTES = 15
+
+# Cards and drawing settings of a worker process, set once by _init_worker
+_worker_state = {}
+
+class SimulationResult:
+    """Aggregated histograms of simulated divinations"""
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.in_range = 0
+        self.total_times = Counter()
+        self.card_counts = Counter()
+        self.levels = Counter()
+        self.tags = Counter()
+
+    def add(self, cards, min_time, max_time):
+        """Record the outcome of one draw"""
+        self.runs += 1
+        if not cards:
+            self.failures += 1
+            return
+
+        total_time = sum(card.estimated_time for card in cards)
+        if min_time <= total_time <= max_time:
+            self.in_range += 1
+        self.total_times[total_time // BUCKET_MINUTES * BUCKET_MINUTES] += 1
+        self.card_counts[len(cards)] += 1
+        self.levels.update(card.level for card in cards)
+        self.tags.update(card.tag or "" for card in cards)
+
+    def merge(self, other):
+        """Merge the histograms of another result into this one"""
+        self.runs += other.runs
+        self.failures += other.failures
+        self.in_range += other.in_range
+        self.total_times.update(other.total_times)
+        self.card_counts.update(other.card_counts)
+        self.levels.update(other.levels)
+        self.tags.update(other.tags)
+        return self
+
+def _init_worker(cards, min_time, max_time, level_weights):
+    """Keep the deck snapshot in the worker so it is only sent once per process"""
+    _worker_state.update(cards=cards, min_time=min_time, max_time=max_time, level_weights=level_weights)
+
+def _simulate_chunk(seed, runs):
+    """Run a chunk of independently seeded draws and aggregate them"""
+    state = _worker_state
+    sampler = CardSampler(state["level_weights"], random.Random(seed))
+    result = SimulationResult()
+    for _ in range(runs):
+        result.add(sampler.draw_combination(state["cards"], state["min_time"], state["max_time"]), state["min_time"], state["max_time"])
+    return result
+
+def _chunks(runs, seed):
+    """Split the runs into chunks, each with its own seed"""
+    seeds = random.Random(seed)
+    for start in range(0, runs, CHUNK_SIZE):
+        yield seeds.getrandbits(64), min(CHUNK_SIZE, runs - start)
+
+def simulate(cards, runs=1000, workers=None, min_time=90, max_time=150, level_weights=None, seed=None):
+    """Simulate many divinations over a snapshot of available cards
+
+    Chunks of draws are spread over a process pool. A running total is yielded
+    each time a chunk finishes, so callers can show progress; the last value
+    yielded is the final result. With the same seed the result does not depend
+    on the number of workers.
+    """
+    workers = workers or os.cpu_count() or 1
+    init_args = (list(cards), min_time, max_time, level_weights)
+    total = SimulationResult()
+
+    if workers == 1:
+        # Not worth starting a pool for a single worker
+        _init_worker(*init_args)
+        for chunk_seed, chunk_runs in _chunks(runs, seed):
+            yield total.merge(_simulate_chunk(chunk_seed, chunk_runs))
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as executor:
+        futures = [executor.submit(_simulate_chunk, chunk_seed, chunk_runs) for chunk_seed, chunk_runs in _chunks(runs, seed)]
+        for future in as_completed(futures):
+            yield total.merge(future.result())
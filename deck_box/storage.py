@@ -1,96 +1,766 @@
+import gzip
 import json
 import os
+import re
+import sqlite3
+import tempfile
+import threading
+import zlib
+from contextlib import closing, contextmanager, nullcontext
+from datetime import datetime, timedelta
 from pathlib import Path
-from .models import Card, DivinationResult
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where concurrent template expansions are only
+    # deduplicated by the IDs of the cards they create
+    fcntl = None
+
+from .analytics import ABANDON_AFTER_DAYS, HistoryAnalytics, completion_event, draw_events
+from .migrations import (
+    READ_CHUNK_SIZE, SCHEMA_VERSION, file_header, migrate_array_file, migrate_lines_file, read_version,
+    upgrade_card, upgrade_divination, upgrade_journal_entry
+)
+from .models import Card, CardStatus, DivinationResult, Template
+from .search import SearchIndex, prefix_upper_bound
+
+DEFAULT_DECK = "default"
+
+# Deck names become directory names, so keep them to word characters and dashes
+DECK_NAME_PATTERN = re.compile(r"^[\w-]+$")
+
+# Number of journal entries after which the journal is folded into the cards file
+COMPACT_THRESHOLD = 1000
+
+# Completed cards older than this many days are moved to the archive
+# (overridable with DECK_BOX_ARCHIVE_DAYS)
+DEFAULT_ARCHIVE_DAYS = 30
+
+# Tables of the index database: card locations and bookkeeping values
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (id TEXT PRIMARY KEY, source TEXT NOT NULL, offset INTEGER NOT NULL, length INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+# Bookkeeping keys of the index
+BASE_KEY = "base"
+JOURNAL_KEY = "journal"
+JOURNAL_ENTRIES_KEY = "journal_entries"
+OLDEST_COMPLETION_KEY = "oldest_completion"
+
+@contextmanager
+def file_lock(path, exclusive=True):
+    """Hold an advisory lock on a lock file, shared or exclusive, between processes
+    
+    Every call opens the file anew, so threads of one process exclude each
+    other as well. Without fcntl (on Windows) this does nothing.
+    """
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def get_app_dir():
+    """Get the application data directory (overridable with DECK_BOX_HOME)"""
+    home = os.environ.get("DECK_BOX_HOME")
+    if home:
+        return Path(home).expanduser()
+    return Path.home() / ".deck_box"
+
+def validate_deck_name(deck):
+    """Validate a deck name and return it, raising ValueError if it is not usable"""
+    if not deck or not DECK_NAME_PATTERN.fullmatch(deck):
+        raise ValueError(f"Invalid deck name: {deck!r}")
+    return deck
 
 class Storage:
     """Storage management class, responsible for persistent storage of cards and divination results"""
-    def __init__(self):
-        # Get user home directory and create application data directory
-        self.app_dir = Path.home() / ".deck_box"
-        self.app_dir.mkdir(exist_ok=True)
+    def __init__(self, deck=DEFAULT_DECK, archive_after_days=None, create=True):
+        """Open a deck, creating it if it does not exist yet
+        
+        With `create` set to False, opening a deck that does not exist raises
+        ValueError instead, so reading a misspelled deck does not create it.
+        """
+        # Get the application data directory
+        self.app_dir = get_app_dir()
+        self.app_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Each deck is stored in its own shard directory. The default deck keeps
+        # living directly in the application directory so existing data is reused.
+        self.deck = validate_deck_name(deck or DEFAULT_DECK)
+        if not create and not self.deck_exists(self.deck):
+            raise ValueError(f"Unknown deck: {self.deck!r}")
+        self.deck_dir = self.deck_path(self.deck)
+        self.deck_dir.mkdir(parents=True, exist_ok=True)
         
         # Define data file paths
-        self.cards_file = self.app_dir / "cards.json"
-        self.divination_file = self.app_dir / "divination.json"
+        self.cards_file = self.deck_dir / "cards.json"
+        self.divination_file = self.deck_dir / "divination.json"
+        
+        # Card changes are appended to the journal and located through the id
+        # index (card ID -> offset in the cards file or journal), so single
+        # cards can be read and written without loading the whole deck
+        self.journal_file = self.deck_dir / "cards.journal"
+        self.index_file = self.deck_dir / "cards.index"
+        
+        # The cards file, the journal and the indexes are read under a shared
+        # lock and written (including rebuilds of the indexes) under an
+        # exclusive one, between processes and between the threads sharing
+        # this storage (e.g. the executor of AsyncStorage). Without fcntl, the
+        # thread lock stands in for both.
+        self.data_lock_file = self.deck_dir / "cards.lock"
+        self._thread_lock = threading.RLock()
+        self._held = threading.local()
+        
+        # Old completed cards are moved out of the deck into a compressed
+        # archive, with their IDs kept in a plain list so predecessors can
+        # still be resolved without decompressing the archive
+        self.archive_file = self.deck_dir / "archive.jsonl.gz"
+        self.archive_ids_file = self.deck_dir / "archive.ids"
+        if archive_after_days is None:
+            archive_after_days = int(os.environ.get("DECK_BOX_ARCHIVE_DAYS", DEFAULT_ARCHIVE_DAYS))
+        self.archive_after = timedelta(days=archive_after_days)
+        self._archived_ids = None
+        self._archived_ids_loaded = None
+        
+        # Full-text index over card names, descriptions and tags
+        self.search_index = SearchIndex(self.deck_dir / "search.index")
+        
+        # Recurring card templates; their expansion into cards is serialized
+        # between processes through the lock file
+        self.templates_file = self.deck_dir / "templates.json"
+        self.lock_file = self.deck_dir / "templates.lock"
+        
+        # Draws and completions are logged to an append-only event log, from
+        # which the analytics rollups are updated incrementally
+        self.events_file = self.deck_dir / "events.jsonl"
+        self.analytics_file = self.deck_dir / "analytics.json"
         
         # Initialize data files
         self._init_files()
     
+    @staticmethod
+    def deck_path(deck):
+        """Get the shard directory of a deck"""
+        if deck == DEFAULT_DECK:
+            return get_app_dir()
+        return get_app_dir() / "decks" / deck
+    
+    @staticmethod
+    def deck_exists(deck):
+        """Check whether a deck exists (the default deck always does)"""
+        return deck == DEFAULT_DECK or Storage.deck_path(deck).is_dir()
+    
+    @staticmethod
+    def list_decks():
+        """List the names of all existing decks"""
+        decks = [DEFAULT_DECK]
+        decks_dir = get_app_dir() / "decks"
+        if decks_dir.is_dir():
+            decks.extend(sorted(p.name for p in decks_dir.iterdir() if p.is_dir()))
+        return decks
+    
     def _init_files(self):
-        """Initialize data files"""
+        """Initialize data files, upgrading files written by older versions"""
         if not self.cards_file.exists():
             with open(self.cards_file, "w", encoding="utf-8") as f:
-                json.dump([], f)
+                f.write(file_header("cards") + "\n]}\n")
         
         if not self.divination_file.exists():
             with open(self.divination_file, "w", encoding="utf-8") as f:
-                json.dump([], f)
+                f.write(file_header("divinations") + "\n]}\n")
+        
+        self._migrate()
+    
+    def _migrate(self):
+        """Upgrade the data files of the deck to the current schema version
+        
+        Only the first bytes of each file are read when it is already current.
+        The journal and the archive carry the version of the cards file, so
+        they are upgraded first and the cards file is stamped last.
+        """
+        version = read_version(self.cards_file)
+        if version < SCHEMA_VERSION:
+            migrate_lines_file(self.journal_file, upgrade_journal_entry, version)
+            migrate_lines_file(self.archive_file, upgrade_card, version, compressed=True)
+            migrate_array_file(self.cards_file, "cards", upgrade_card)
+        migrate_array_file(self.divination_file, "divinations", upgrade_divination)
     
     def save_cards(self, cards):
         """Save all cards to file"""
-        cards_data = [card.to_dict() for card in cards]
-        with open(self.cards_file, "w", encoding="utf-8") as f:
-            json.dump(cards_data, f, ensure_ascii=False, indent=2)
+        with self._data_lock(exclusive=True):
+            self._write_cards_data(card.to_dict() for card in cards)
+            self.search_index.clear()
     
     def load_cards(self):
         """Load all cards from file"""
-        with open(self.cards_file, "r", encoding="utf-8") as f:
-            cards_data = json.load(f)
-        return [Card.from_dict(data) for data in cards_data]
+        with self._data_lock():
+            cards_data = self._load_cards_data()
+        return [Card.from_dict(data) for data in cards_data.values()]
     
     def add_card(self, card):
         """Add a new card"""
-        cards = self.load_cards()
-        cards.append(card)
-        self.save_cards(cards)
+        self._put_card(card)
     
     def get_card_by_id(self, card_id):
         """Get card by ID"""
-        cards = self.load_cards()
-        for card in cards:
-            if card.id == card_id:
-                return card
-        return None
+        cards = self.get_cards_by_ids([card_id])
+        return cards[0] if cards else None
+    
+    def get_cards_by_ids(self, card_ids):
+        """Get the cards with the given IDs, skipping unknown IDs"""
+        cards = []
+        with self._open_index() as index:
+            for card_id in card_ids:
+                location = index.execute("SELECT source, offset, length FROM cards WHERE id = ?", (card_id,)).fetchone()
+                if location is None:
+                    continue
+                source, offset, length = location
+                path = self.journal_file if source == "j" else self.cards_file
+                with open(path, "rb") as f:
+                    f.seek(offset)
+                    data = json.loads(f.read(length))
+                cards.append(Card.from_dict(data["card"] if source == "j" else data))
+        return cards
+    
+    def resolve_card_id(self, prefix, limit=2):
+        """Get the IDs of the cards whose ID starts with `prefix` (at most `limit` of them)"""
+        if not prefix:
+            return []
+        with self._open_index() as index:
+            if index.execute("SELECT 1 FROM cards WHERE id = ?", (prefix,)).fetchone():
+                return [prefix]
+            rows = index.execute(
+                "SELECT id FROM cards WHERE id >= ? AND id < ? ORDER BY id LIMIT ?",
+                (prefix, prefix_upper_bound(prefix), limit)
+            )
+            return [row[0] for row in rows]
+    
+    def search_cards(self, query, limit=20):
+        """Find the cards whose name, description or tag match every term of the query"""
+        with self._data_lock():
+            ready = self.search_index.is_ready()
+        if not ready:
+            with self._data_lock(exclusive=True):
+                # Another process or thread may have rebuilt the index in the meantime
+                if not self.search_index.is_ready():
+                    self.search_index.rebuild(self.load_cards())
+        with self._data_lock():
+            card_ids = self.search_index.search(query, limit)
+        return self.get_cards_by_ids(card_ids)
     
     def update_card(self, updated_card):
-        """Update card information"""
-        cards = self.load_cards()
-        for i, card in enumerate(cards):
-            if card.id == updated_card.id:
-                cards[i] = updated_card
-                self.save_cards(cards)
-                return True
-        return False
+        """Update card information, logging the completion of completed cards"""
+        if not self._put_card(updated_card, must_exist=True):
+            return False
+        if updated_card.status == CardStatus.COMPLETED and updated_card.completed_at:
+            # Repeated completion events of a card are ignored by the analytics
+            self._append_events([completion_event(updated_card)])
+        return True
     
     def delete_card(self, card_id):
         """Delete card by ID"""
-        cards = self.load_cards()
-        original_length = len(cards)
-        cards = [card for card in cards if card.id != card_id]
-        if len(cards) < original_length:
-            self.save_cards(cards)
+        with self._data_lock(exclusive=True):
+            with self._open_index() as index:
+                if not index.execute("DELETE FROM cards WHERE id = ?", (card_id,)).rowcount:
+                    return False
+                entries = self._append_journal(index, {"op": "delete", "id": card_id})[2]
+                compact = self._compaction_is_due(index, entries)
+            self.search_index.remove([card_id])
+            if compact:
+                self.compact()
+        return True
+    
+    def compact(self):
+        """Fold the journal into the cards file, archive old completed cards and rebuild the index"""
+        with self._data_lock(exclusive=True):
+            cards_data = self._load_cards_data()
+            self._archive_cards_data(cards_data)
+            self._write_cards_data(cards_data.values())
+    
+    def archived_ids(self):
+        """Get the IDs of all archived cards, reloading them when another process archived more"""
+        signature = self._archived_ids_signature()
+        if self._archived_ids is None or signature != self._archived_ids_loaded:
+            archived_ids = set()
+            if self.archive_ids_file.exists():
+                with open(self.archive_ids_file, "r", encoding="utf-8") as f:
+                    archived_ids.update(line.strip() for line in f if line.strip())
+            self._archived_ids = archived_ids
+            self._archived_ids_loaded = signature
+        return self._archived_ids
+    
+    def _archived_ids_signature(self):
+        """Identify the current version of the archived IDs"""
+        if not self.archive_ids_file.exists():
+            return None
+        stat = self.archive_ids_file.stat()
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    
+    def is_archived(self, card_id):
+        """Check whether a card has been archived"""
+        return card_id in self.archived_ids()
+    
+    def iter_archived_cards(self):
+        """Stream the archived cards without loading the whole archive
+        
+        A gzip member cut off by an interrupted archival ends the archive; it
+        is removed by the next archival.
+        """
+        if not self.archive_file.exists():
+            return
+        with gzip.open(self.archive_file, "rt", encoding="utf-8") as f:
+            while True:
+                try:
+                    line = f.readline()
+                except (EOFError, gzip.BadGzipFile, zlib.error):
+                    return
+                if not line:
+                    return
+                if line.endswith("\n"):
+                    yield Card.from_dict(json.loads(line))
+    
+    def signature(self):
+        """Identify the current version of the deck's cards; it changes with every write"""
+        return f"{self._base_signature()}/{self._journal_signature()}"
+    
+    def _archive_cards_data(self, cards_data):
+        """Move old completed cards from `cards_data` to the archive, returning how many were moved"""
+        cutoff = datetime.now() - self.archive_after
+        expired = [
+            data for data in cards_data.values()
+            if data["status"] == CardStatus.COMPLETED.value
+            and data["completed_at"] and datetime.fromisoformat(data["completed_at"]) <= cutoff
+        ]
+        if not expired:
+            return 0
+        
+        # The IDs are recorded first, then the cards are appended to the
+        # archive and only then removed from the deck. Expired cards whose IDs
+        # are recorded already were left in the deck by an interrupted run,
+        # which may not have reached the archive; only then is the archive
+        # scanned, to append those that are missing from it
+        archived_ids = self.archived_ids()
+        new_ids = [data["id"] for data in expired if data["id"] not in archived_ids]
+        leftover = {data["id"] for data in expired if data["id"] in archived_ids}
+        if leftover:
+            self._cut_partial_archive_member()
+            leftover.difference_update(card.id for card in self.iter_archived_cards())
+        missing = [data for data in expired if data["id"] not in archived_ids or data["id"] in leftover]
+        
+        if new_ids:
+            with open(self.archive_ids_file, "a", encoding="utf-8") as f:
+                f.write("".join(card_id + "\n" for card_id in new_ids))
+                f.flush()
+                os.fsync(f.fileno())
+            archived_ids.update(new_ids)
+        if missing:
+            # Every append adds a complete new gzip member, which gzip reads
+            # back transparently
+            lines = "".join(json.dumps(data, ensure_ascii=False) + "\n" for data in missing)
+            with open(self.archive_file, "ab") as raw:
+                with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+                    f.write(lines.encode("utf-8"))
+                raw.flush()
+                os.fsync(raw.fileno())
+        
+        for data in expired:
+            del cards_data[data["id"]]
+        self.search_index.remove(data["id"] for data in expired)
+        return len(expired)
+    
+    def _cut_partial_archive_member(self):
+        """Truncate the archive after its last complete gzip member, dropping what an interrupted append left"""
+        if not self.archive_file.exists():
+            return
+        complete = offset = 0
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        with open(self.archive_file, "rb") as f:
+            chunk = f.read(READ_CHUNK_SIZE)
+            while chunk:
+                try:
+                    decompressor.decompress(chunk)
+                except zlib.error:
+                    break
+                if decompressor.eof:
+                    # The next member starts in the data the finished one left over
+                    offset += len(chunk) - len(decompressor.unused_data)
+                    complete = offset
+                    chunk = decompressor.unused_data or f.read(READ_CHUNK_SIZE)
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                else:
+                    offset += len(chunk)
+                    chunk = f.read(READ_CHUNK_SIZE)
+        if complete < self.archive_file.stat().st_size:
+            with open(self.archive_file, "r+b") as f:
+                f.truncate(complete)
+    
+    def _put_card(self, card, must_exist=False):
+        """Write a single card to the journal"""
+        with self._data_lock(exclusive=True):
+            with self._open_index() as index:
+                if must_exist and not index.execute("SELECT 1 FROM cards WHERE id = ?", (card.id,)).fetchone():
+                    return False
+                offset, length, entries = self._append_journal(index, {"op": "put", "card": card.to_dict()})
+                index.execute("INSERT OR REPLACE INTO cards VALUES (?, 'j', ?, ?)", (card.id, offset, length))
+                if card.status == CardStatus.COMPLETED and card.completed_at:
+                    oldest = self._get_meta(index, OLDEST_COMPLETION_KEY)
+                    if not oldest or card.completed_at < datetime.fromisoformat(oldest):
+                        self._set_meta(index, OLDEST_COMPLETION_KEY, card.completed_at.isoformat())
+                compact = self._compaction_is_due(index, entries)
+            self.search_index.update(card)
+            if compact:
+                self.compact()
+        return True
+    
+    def _append_journal(self, index, entry):
+        """Append an entry to the journal and return its offset, its length and the journal length"""
+        line = json.dumps(entry, ensure_ascii=False).encode("utf-8")
+        with open(self.journal_file, "ab") as f:
+            offset = f.tell()
+            f.write(line + b"\n")
+        entries = int(self._get_meta(index, JOURNAL_ENTRIES_KEY)) + 1
+        self._set_meta(index, JOURNAL_KEY, self._journal_signature())
+        self._set_meta(index, JOURNAL_ENTRIES_KEY, str(entries))
+        return offset, len(line), entries
+    
+    def _compaction_is_due(self, index, entries):
+        """Check whether the journal has grown too long or a completed card is old enough to be archived
+        
+        Archival only happens when the deck is written, so reading the deck
+        never changes it.
+        """
+        if entries >= COMPACT_THRESHOLD:
             return True
-        return False
+        oldest = self._get_meta(index, OLDEST_COMPLETION_KEY)
+        return bool(oldest) and datetime.fromisoformat(oldest) <= datetime.now() - self.archive_after
+    
+    def _read_journal(self):
+        """Read all journal entries"""
+        if not self.journal_file.exists():
+            return
+        with open(self.journal_file, "rb") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Skip an entry whose append was interrupted
+                    continue
+    
+    def _load_cards_data(self):
+        """Load the card dictionaries of the deck keyed by ID, with the journal replayed"""
+        with open(self.cards_file, "r", encoding="utf-8") as f:
+            cards_data = {data["id"]: data for data in json.load(f)["cards"]}
+        
+        for entry in self._read_journal():
+            if entry["op"] == "put":
+                cards_data[entry["card"]["id"]] = entry["card"]
+            else:
+                cards_data.pop(entry["id"], None)
+        return cards_data
+    
+    def _write_cards_data(self, cards_data):
+        """Rewrite the cards file with one card per line, reset the journal and rebuild the index"""
+        oldest = None
+        
+        def track_completions(cards_data):
+            nonlocal oldest
+            for data in cards_data:
+                if data["status"] == CardStatus.COMPLETED.value and data["completed_at"]:
+                    completed_at = datetime.fromisoformat(data["completed_at"])
+                    oldest = completed_at if oldest is None else min(oldest, completed_at)
+                yield data
+        
+        # The new cards file and index are built under unique names and moved
+        # into place, so readers never see them half-written
+        with self._data_lock(exclusive=True):
+            fd, tmp_file = tempfile.mkstemp(prefix=self.cards_file.name + ".", suffix=".tmp", dir=self.deck_dir)
+            fd_index, tmp_index = tempfile.mkstemp(prefix=self.index_file.name + ".", suffix=".tmp", dir=self.deck_dir)
+            os.close(fd_index)
+            try:
+                with os.fdopen(fd, "wb") as f, closing(self._connect_index(tmp_index)) as index:
+                    f.write(file_header("cards").encode("utf-8"))
+                    with index:
+                        rows = self._write_lines(f, track_completions(cards_data))
+                        index.executemany("INSERT OR REPLACE INTO cards VALUES (?, 'b', ?, ?)", rows)
+                    f.write(b"\n]}\n")
+                    f.close()
+                    os.replace(tmp_file, self.cards_file)
+                    
+                    # Any journal entries are part of the new cards file now
+                    open(self.journal_file, "wb").close()
+                    with index:
+                        self._set_meta(index, BASE_KEY, self._base_signature())
+                        self._set_meta(index, JOURNAL_KEY, self._journal_signature())
+                        self._set_meta(index, JOURNAL_ENTRIES_KEY, "0")
+                        # The oldest completion decides when the next write archives cards
+                        self._set_meta(index, OLDEST_COMPLETION_KEY, oldest.isoformat() if oldest else "")
+                # A rollback journal left by an interrupted write of the old
+                # index must not be applied to the new one
+                index_journal = self.index_file.with_name(self.index_file.name + "-journal")
+                if index_journal.exists():
+                    index_journal.unlink()
+                os.replace(tmp_index, self.index_file)
+            finally:
+                for path in (tmp_file, tmp_index):
+                    if os.path.exists(path):
+                        os.unlink(path)
+    
+    @staticmethod
+    def _write_lines(f, cards_data):
+        """Write cards one per line, yielding the index row of each card"""
+        separator = b"\n"
+        for data in cards_data:
+            line = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            f.write(separator)
+            yield data["id"], f.tell(), len(line)
+            f.write(line)
+            separator = b",\n"
+    
+    def _base_signature(self):
+        """Identify the current version of the cards file"""
+        stat = self.cards_file.stat()
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    
+    def _journal_signature(self):
+        """Identify the current version of the journal"""
+        return str(self.journal_file.stat().st_size) if self.journal_file.exists() else "0"
+    
+    def _connect_index(self, path=None):
+        """Connect to the index database (or a new one at `path`), creating its tables if needed"""
+        index = sqlite3.connect(path or self.index_file)
+        # The index can always be rebuilt from the data files, so skip fsyncs
+        index.execute("PRAGMA synchronous = OFF")
+        index.executescript(INDEX_SCHEMA)
+        return index
+    
+    @staticmethod
+    def _get_meta(index, key):
+        """Read a bookkeeping value of the index"""
+        row = index.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+    
+    @staticmethod
+    def _set_meta(index, key, value):
+        """Write a bookkeeping value of the index"""
+        index.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+    
+    def _index_is_current(self, index):
+        """Check whether the index still matches the data files"""
+        return (self._get_meta(index, BASE_KEY) == self._base_signature()
+                and self._get_meta(index, JOURNAL_KEY) == self._journal_signature())
+    
+    @contextmanager
+    def _open_index(self, exclusive=False):
+        """Open the index in a transaction under the data lock, rebuilding it if the data files changed behind its back
+        
+        Only a holder of the exclusive lock rebuilds the index; a reader
+        finding it stale takes the lock exclusively and checks again, so
+        only the first process or thread to get the lock rebuilds it.
+        """
+        while True:
+            with self._data_lock(exclusive):
+                index = self._connect_current_index()
+                if index is None and self._holds_exclusive_lock():
+                    # The data files may have been edited by hand, so the search
+                    # index cannot be trusted either
+                    self.search_index.clear()
+                    self.compact()
+                    index = self._connect_index()
+                if index is not None:
+                    try:
+                        with index:
+                            yield index
+                    finally:
+                        index.close()
+                    return
+            exclusive = True
     
-    def save_divination(self, divination):
-        """Save divination result"""
+    def _connect_current_index(self):
+        """Connect to the index if it still matches the data files, returning None otherwise"""
+        if not self.index_file.exists():
+            return None
+        index = None
+        try:
+            index = self._connect_index()
+            if self._index_is_current(index):
+                return index
+        except sqlite3.DatabaseError:
+            # A damaged index is simply rebuilt
+            pass
+        if index is not None:
+            index.close()
+        return None
+    
+    def load_templates(self):
+        """Load all recurring card templates"""
+        if not self.templates_file.exists():
+            return []
+        with open(self.templates_file, "r", encoding="utf-8") as f:
+            return [Template.from_dict(data) for data in json.load(f)["templates"]]
+    
+    def add_template(self, template):
+        """Add a new recurring card template"""
+        with self._lock():
+            self._write_templates(self.load_templates() + [template])
+    
+    def delete_template(self, template_id):
+        """Delete a template by ID; the cards it already created are kept"""
+        with self._lock():
+            templates = self.load_templates()
+            remaining = [template for template in templates if template.id != template_id]
+            if len(remaining) == len(templates):
+                return False
+            self._write_templates(remaining)
+        return True
+    
+    def materialize_templates(self, now=None):
+        """Create the cards of the current occurrence of every template, returning the new cards
+        
+        Cards are only created for the occurrence that is current at `now`;
+        missed occurrences are not back-filled and future ones are created
+        when their time comes. Each template remembers its last expanded
+        occurrence and the card of an occurrence always has the same ID, so
+        expanding again, or from several processes at once, never creates a
+        card twice.
+        """
+        now = now or datetime.now()
+        if not self.has_due_templates(now):
+            return []
+        
+        created = []
+        with self._lock():
+            # Another process may have expanded the templates in the meantime
+            templates = self.load_templates()
+            for template in templates:
+                if not self._template_is_due(template, now):
+                    continue
+                occurrence = template.occurrence_at(now)
+                card = template.instance(occurrence)
+                if not self.get_card_by_id(card.id) and not self.is_archived(card.id):
+                    self.add_card(card)
+                    created.append(card)
+                template.last_occurrence = occurrence
+            self._write_templates(templates)
+        return created
+    
+    def has_due_templates(self, now=None):
+        """Check whether any template has an occurrence that has not been expanded yet"""
+        now = now or datetime.now()
+        return any(self._template_is_due(template, now) for template in self.load_templates())
+    
+    @staticmethod
+    def _template_is_due(template, now):
+        """Check whether the current occurrence of a template has not been expanded yet"""
+        occurrence = template.occurrence_at(now)
+        return occurrence is not None and (template.last_occurrence is None or occurrence > template.last_occurrence)
+    
+    def _write_templates(self, templates):
+        """Replace the templates file"""
+        tmp_file = self.templates_file.with_name(self.templates_file.name + ".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(file_header("templates"))
+            for i, template in enumerate(templates):
+                f.write((",\n" if i else "\n") + json.dumps(template.to_dict(), ensure_ascii=False))
+            f.write("\n]}\n")
+        os.replace(tmp_file, self.templates_file)
+    
+    @contextmanager
+    def _lock(self):
+        """Hold the deck's lock file exclusively, serializing template changes between processes"""
+        with file_lock(self.lock_file):
+            yield
+    
+    @contextmanager
+    def _data_lock(self, exclusive=False):
+        """Hold the lock of the cards data, shared to read or exclusive to write
+        
+        The lock is reentrant within a thread, but a thread holding it shared
+        cannot take it exclusively.
+        """
+        held = getattr(self._held, "mode", None)
+        if held == "exclusive" or (held == "shared" and not exclusive):
+            yield
+            return
+        if held == "shared":
+            raise RuntimeError("The data lock cannot be upgraded from shared to exclusive")
+        with (self._thread_lock if fcntl is None else nullcontext()), file_lock(self.data_lock_file, exclusive):
+            self._held.mode = "exclusive" if exclusive else "shared"
+            try:
+                yield
+            finally:
+                self._held.mode = None
+    
+    def _holds_exclusive_lock(self):
+        """Check whether this thread holds the data lock exclusively"""
+        return getattr(self._held, "mode", None) == "exclusive"
+    
+    def save_divination(self, divination, card_decks=None):
+        """Save divination result
+        
+        `card_decks` maps the IDs of cards drawn from other decks to their
+        deck; their draws are logged there, next to their completions.
+        """
         divinations = self.load_divinations()
         divinations.append(divination)
         # Keep only the last 10 divination records
         if len(divinations) > 10:
             divinations = divinations[-10:]
         
-        divinations_data = [d.to_dict() for d in divinations]
         with open(self.divination_file, "w", encoding="utf-8") as f:
-            json.dump(divinations_data, f, ensure_ascii=False, indent=2)
+            f.write(file_header("divinations"))
+            for i, d in enumerate(divinations):
+                f.write((",\n" if i else "\n") + json.dumps(d.to_dict(), ensure_ascii=False))
+            f.write("\n]}\n")
+        
+        # The event log keeps the full history for the analytics
+        deck_events = {}
+        for event in draw_events(divination):
+            deck = (card_decks or {}).get(event["card_id"], self.deck)
+            deck_events.setdefault(deck, []).append(event)
+        for deck, events in deck_events.items():
+            storage = self if deck == self.deck else Storage(deck, create=False)
+            storage._append_events(events)
     
     def load_divinations(self):
         """Load all divination results"""
         with open(self.divination_file, "r", encoding="utf-8") as f:
-            divinations_data = json.load(f)
+            divinations_data = json.load(f)["divinations"]
         return [DivinationResult.from_dict(data) for data in divinations_data]
     
+    def history_analytics(self, window_days=ABANDON_AFTER_DAYS, now=None):
+        """Get the draw and completion analytics, updated with the events logged since the last call
+        
+        Only new events are read; the rollups and the draws still waiting for
+        a completion are saved for the next call. Changing the window starts
+        over from the beginning of the event log.
+        """
+        analytics = None
+        if self.analytics_file.exists():
+            with open(self.analytics_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data["window_days"] == window_days:
+                analytics = HistoryAnalytics.from_dict(data)
+        analytics = analytics or HistoryAnalytics(window_days)
+        analytics.update(self.events_file)
+        analytics.expire(now or datetime.now())
+        
+        tmp_file = self.analytics_file.with_name(self.analytics_file.name + ".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(analytics.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_file, self.analytics_file)
+        return analytics
+    
+    def _append_events(self, events):
+        """Append events to the event log"""
+        with open(self.events_file, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events))
+    
     def get_last_divination(self):
         """Get the most recent divination result"""
         divinations = self.load_divinations()
@@ -0,0 +1,21 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+class TemporaryHomeMixin:
+    """Run every test against a temporary DECK_BOX_HOME"""
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {"DECK_BOX_HOME": self.tmp_dir.name})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+        self.tmp_dir.cleanup()
+
+class StorageTestCase(TemporaryHomeMixin, unittest.TestCase):
+    """Base test case running every test against a temporary DECK_BOX_HOME"""
+
+class AsyncStorageTestCase(TemporaryHomeMixin, unittest.IsolatedAsyncioTestCase):
+    """Base asyncio test case running every test against a temporary DECK_BOX_HOME"""
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from deck_box.aio import AsyncDivination, AsyncStorage
+from deck_box.models import Card, DivinationResult
+from deck_box.storage import Storage
+from helpers import AsyncStorageTestCase
+
+class TestAsyncStorage(AsyncStorageTestCase):
+    async def asyncSetUp(self):
+        Storage().save_cards([Card(f"任务{i}", 10 + i) for i in range(20)])
+        self.storage = await AsyncStorage.open()
+
+    async def asyncTearDown(self):
+        await self.storage.close()
+
+    async def test_concurrent_loads_are_coalesced(self):
+        """Test concurrent reads of the same deck version share one load"""
+        load_cards = Storage.load_cards
+        calls = []
+
+        def slow_load(storage):
+            calls.append(1)
+            time.sleep(0.05)
+            return load_cards(storage)
+
+        with mock.patch.object(Storage, "load_cards", slow_load):
+            results = await asyncio.gather(*(self.storage.load_cards() for _ in range(10)))
+            self.assertEqual(len(calls), 1)
+            self.assertTrue(all(len(cards) == 20 for cards in results))
+
+            # A write makes a new version, which is loaded again
+            await self.storage.add_card(Card("新任务", 5))
+            self.assertEqual(len(await self.storage.load_cards()), 21)
+            self.assertEqual(len(calls), 2)
+
+    async def test_writes_are_serialized_in_order(self):
+        """Test concurrent writes are all applied, one after another in submission order"""
+        cards = [Card(f"并发{i}", 5) for i in range(30)]
+        await asyncio.gather(*(self.storage.add_card(card) for card in cards))
+
+        loaded = [card.name for card in Storage().load_cards()]
+        self.assertEqual(loaded[20:], [card.name for card in cards])
+
+    async def test_concurrent_reads_of_a_stale_index(self):
+        """Test concurrent reads rebuilding a stale index all succeed and rebuild it once"""
+        cards = Storage().load_cards()
+        # Edit the cards file by hand, so the index no longer matches it
+        with open(self.storage.storage.cards_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        with open(self.storage.storage.cards_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+        compact = Storage.compact
+        calls = []
+
+        def counting_compact(storage):
+            calls.append(1)
+            compact(storage)
+
+        with ThreadPoolExecutor(16) as executor, mock.patch.object(Storage, "compact", counting_compact):
+            storage = AsyncStorage(self.storage.storage, executor)
+            found = await asyncio.gather(*(storage.get_card_by_id(card.id) for card in cards[:16]))
+
+        self.assertEqual([card.id for card in found], [card.id for card in cards[:16]])
+        self.assertEqual(len(calls), 1)
+
+    async def test_event_loop_is_not_blocked(self):
+        """Test the event loop keeps running while a slow load is in progress"""
+        with mock.patch.object(Storage, "load_cards", lambda storage: time.sleep(0.3) or []):
+            load = asyncio.ensure_future(self.storage.load_cards())
+            largest_lag = 0
+            while not load.done():
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                largest_lag = max(largest_lag, time.perf_counter() - start - 0.01)
+            await load
+        self.assertLess(largest_lag, 0.1)
+
+    async def test_concurrent_divinations(self):
+        """Test concurrent draws all succeed and their results are all saved"""
+        divination = AsyncDivination(self.storage)
+
+        async def draw():
+            cards = await divination.perform_divination(30, 60)
+            await self.storage.save_divination(DivinationResult(cards))
+            return cards
+
+        results = await asyncio.gather(*(draw() for _ in range(8)))
+
+        for cards in results:
+            self.assertTrue(30 <= sum(card.estimated_time for card in cards) <= 60)
+        self.assertEqual(len(await self.storage.load_divinations()), 8)
+
+if __name__ == '__main__':
+    unittest.main()
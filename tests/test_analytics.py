@@ -0,0 +1,108 @@
+import json
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import mock
+from deck_box.analytics import HistoryAnalytics
+from deck_box.divination import Divination
+from deck_box.models import Card, DivinationResult, Mood, Quality
+from deck_box.storage import Storage
+from helpers import StorageTestCase
+
+START = datetime(2024, 1, 1, 9, 0)
+
+def draw(card_id, at, level=1, tag="work"):
+    return {"type": "draw", "at": at.isoformat(), "card_id": card_id, "level": level, "tag": tag}
+
+def complete(card_id, at):
+    return {"type": "complete", "at": at.isoformat(), "card_id": card_id}
+
+class TestHistoryAnalytics(unittest.TestCase):
+    def test_draws_are_joined_with_completions(self):
+        """Test completed, redrawn and expired draws are counted per level and tag"""
+        analytics = HistoryAnalytics(window_days=7)
+        for event in [
+            draw("a", START),
+            draw("b", START, level=3, tag="home"),
+            complete("a", START + timedelta(hours=2)),
+            draw("b", START + timedelta(days=1), level=3, tag="home"),
+            draw("c", START + timedelta(days=1)),
+            complete("c", START + timedelta(days=9)),
+            complete("a", START + timedelta(days=9)),
+        ]:
+            analytics.process(event)
+
+        work, home = analytics.tags["work"], analytics.tags["home"]
+        self.assertEqual((work.draws, work.completed, work.abandoned), (2, 1, 1))
+        self.assertEqual(work.mean_hours, 2)
+        self.assertEqual((home.draws, home.completed, home.abandoned), (2, 0, 2))
+        self.assertEqual(analytics.levels[1].conversion_rate, 0.5)
+        self.assertEqual(len(analytics.open_draws), 0)
+
+    def test_memory_is_bounded_by_window(self):
+        """Test only the draws of the current window are held in memory"""
+        analytics = HistoryAnalytics(window_days=2)
+        largest = 0
+        for day in range(365):
+            for i in range(10):
+                analytics.process(draw(f"{day}-{i}", START + timedelta(days=day, minutes=i)))
+            largest = max(largest, len(analytics.open_draws))
+
+        self.assertLessEqual(largest, 30)
+        self.assertEqual(analytics.levels[1].draws, 3650)
+        self.assertEqual(analytics.levels[1].abandoned + len(analytics.open_draws), 3650)
+
+class TestStoredAnalytics(StorageTestCase):
+
+    def test_rollups_are_updated_incrementally(self):
+        """Test draws and completions are logged and only new events are read on the next run"""
+        storage = Storage()
+        card = Card("写周报", 20, "work")
+        storage.add_card(card)
+        storage.save_divination(DivinationResult([card]))
+
+        first = storage.history_analytics()
+        self.assertEqual(first.tags["work"].draws, 1)
+        self.assertEqual(len(first.open_draws), 1)
+
+        card.complete(Mood.GOOD, 20, Quality.GOOD)
+        storage.update_card(card)
+        processed = []
+        process = HistoryAnalytics.process
+        with mock.patch.object(HistoryAnalytics, "process", lambda self, event: processed.append(event) or process(self, event)):
+            second = Storage().history_analytics()
+        self.assertEqual([event["type"] for event in processed], ["complete"])
+        self.assertEqual(second.tags["work"].completed, 1)
+        self.assertEqual(second.offset, Path(storage.events_file).stat().st_size)
+
+        # Every draw counts once even though the divination history keeps only 10
+        for _ in range(12):
+            storage.save_divination(DivinationResult([Card("浇花", 5, "home")]))
+        later = storage.history_analytics(now=datetime.now() + timedelta(days=30))
+        self.assertEqual(later.tags["home"].draws, 12)
+        self.assertEqual(later.tags["home"].abandoned, 12)
+        with open(storage.analytics_file, encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["open_draws"], [])
+
+    def test_cross_deck_draws_are_logged_in_their_deck(self):
+        """Test a card drawn from another deck is logged where it is completed"""
+        work = Storage("work")
+        home = Storage("home")
+        report = Card("写周报", 20, "work")
+        kitchen = Card("打扫厨房", 15, "home")
+        work.add_card(report)
+        home.add_card(kitchen)
+
+        divination = Divination("work", decks=["work", "home"])
+        divination._get_available_cards()
+        work.save_divination(DivinationResult([report, kitchen]), divination.card_decks)
+        kitchen.complete(Mood.GOOD, 15, Quality.GOOD)
+        home.update_card(kitchen)
+
+        self.assertEqual(home.history_analytics().tags["home"].completed, 1)
+        self.assertEqual(home.history_analytics().tags["home"].draws, 1)
+        self.assertEqual(work.history_analytics().tags["work"].draws, 1)
+        self.assertNotIn("home", work.history_analytics().tags)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import random
+import unittest
+from collections import Counter
+from datetime import datetime, timedelta
+from deck_box.divination import AvailabilityIndex, CardSampler, DrawConstraints, ReadyQueue, urgency_score
+from deck_box.models import Card, Mood, Quality
+
+class TestConstrainedDraw(unittest.TestCase):
+    def setUp(self):
+        self.cards = (
+            [Card(f"家务{i}", 10 + i, "home") for i in range(20)]
+            + [Card(f"大项目{i}", 90, "work") for i in range(5)]
+            + [Card("写周报", 25, "work")]
+        )
+
+    def test_constraints_are_satisfied(self):
+        """Test every drawn combination satisfies tight constraints"""
+        constraints = DrawConstraints(tag_min={"work": 2}, tag_max={"home": 1}, level_max={4: 1}, max_cards=3)
+        for seed in range(50):
+            sampler = CardSampler(rng=random.Random(seed))
+            cards = sampler.draw_constrained(self.cards, 120, 130, constraints)
+
+            self.assertIsNotNone(cards)
+            tags = Counter(card.tag for card in cards)
+            total_time = sum(card.estimated_time for card in cards)
+            self.assertGreaterEqual(tags["work"], 2)
+            self.assertLessEqual(tags["home"], 1)
+            self.assertLessEqual(sum(card.level == 4 for card in cards), 1)
+            self.assertLessEqual(len(cards), 3)
+            self.assertTrue(120 <= total_time <= 130)
+
+    def test_infeasible_constraints(self):
+        """Test an impossible combination is reported quickly instead of searched forever"""
+        constraints = DrawConstraints(tag_min={"work": 3}, level_max={4: 1}, max_cards=5)
+        self.assertIsNone(CardSampler().draw_constrained(self.cards, 60, 500, constraints))
+
+    def test_search_budget_counts_examined_cards(self):
+        """Test rejected candidates count against the search budget on a large deck"""
+        examined = 0
+
+        class CountingConstraints(DrawConstraints):
+            def allows(self, card, tag_counts, level_counts):
+                nonlocal examined
+                examined += 1
+                return super().allows(card, tag_counts, level_counts)
+
+        # Three 20-minute cards are needed, but only two of their level are allowed
+        cards = [Card(f"任务{i}", 20) for i in range(5000)]
+        constraints = CountingConstraints(level_max={2: 2}, max_cards=5)
+
+        self.assertIsNone(CardSampler().draw_constrained(cards, 50, 60, constraints, max_steps=10000))
+        self.assertLessEqual(examined, len(cards) + 10000)
+
+class TestReadyQueue(unittest.TestCase):
+    def setUp(self):
+        self.now = datetime(2024, 6, 1, 9, 0)
+
+    def test_urgency_score(self):
+        """Test due dates and priorities raise the score of a card"""
+        plain = Card("整理书桌", 20)
+        important = Card("整理书桌", 20, priority=5)
+        due_soon = Card("整理书桌", 20, due_at=self.now + timedelta(days=1))
+        overdue = Card("整理书桌", 20, due_at=self.now - timedelta(days=1))
+        due_later = Card("整理书桌", 20, due_at=self.now + timedelta(days=30))
+
+        score = lambda card: urgency_score(card, now=self.now)
+        self.assertEqual(score(plain), 9)
+        self.assertEqual(score(due_later), score(plain))
+        self.assertLess(score(plain), score(important))
+        self.assertLess(score(important), score(due_soon))
+        self.assertLess(score(due_soon), score(overdue))
+
+    def test_pop_most_urgent_card_that_fits(self):
+        """Test the most urgent card is popped, skipping cards that are too long"""
+        long_overdue = Card("年度总结", 120, due_at=self.now - timedelta(days=2))
+        important = Card("回复客户", 20, priority=5)
+        plain = Card("浇花", 5)
+        queue = ReadyQueue([plain, long_overdue, important], now=self.now)
+
+        self.assertIs(queue.peek(), long_overdue)
+        self.assertIs(queue.pop(max_time=60), important)
+        self.assertIs(queue.pop(max_time=60), plain)
+        self.assertIsNone(queue.pop(max_time=60))
+        self.assertEqual(len(queue), 1)
+        self.assertIs(queue.pop(), long_overdue)
+
+    def test_draw_leaves_queue_unchanged(self):
+        """Test drawing fills the time range in order of urgency without consuming the queue"""
+        cards = [Card(f"任务{i}", 30, priority=i) for i in range(1, 6)]
+        queue = ReadyQueue(cards, now=self.now)
+
+        drawn = queue.draw(min_time=60, max_time=90)
+
+        self.assertEqual([card.priority for card in drawn], [5, 4])
+        self.assertEqual(len(queue), 5)
+        self.assertIs(queue.peek(), cards[4])
+
+    def test_repeated_draws_keep_tie_order(self):
+        """Test drawing again from the same queue draws the same equally urgent cards"""
+        cards = [Card(f"任务{i}", 30) for i in range(6)]
+        queue = ReadyQueue(cards, now=self.now)
+
+        first = queue.draw(min_time=60, max_time=90)
+
+        self.assertEqual(first, cards[:2])
+        self.assertEqual(queue.draw(min_time=60, max_time=90), first)
+
+    def test_extend_rescores_queued_cards(self):
+        """Test adding cards in bulk rescores the cards that are already queued"""
+        cards = [Card(f"任务{i}", 30) for i in range(3)]
+        queue = ReadyQueue(cards, now=self.now)
+        cards[2].priority = 5
+
+        queue.extend([cards[2], Card("新任务", 30, priority=1)])
+
+        self.assertEqual(len(queue), 4)
+        self.assertIs(queue.peek(), cards[2])
+
+    def test_queue_follows_availability(self):
+        """Test the queue gains unlocked cards and loses completed ones incrementally"""
+        first = Card("写大纲", 20, priority=1)
+        second = Card("写正文", 50, predecessor_id=first.id, due_at=self.now)
+        queue = ReadyQueue(now=self.now)
+        index = AvailabilityIndex([first, second], ready_queue=queue)
+        self.assertEqual(len(queue), 1)
+
+        first.complete(Mood.GOOD, 20, Quality.GOOD)
+        index.update(first)
+
+        self.assertEqual(len(queue), 1)
+        self.assertIs(queue.peek(), second)
+        index.remove(second.id)
+        self.assertIsNone(queue.peek())
+
+if __name__ == '__main__':
+    unittest.main()
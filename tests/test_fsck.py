@@ -0,0 +1,127 @@
+import io
+import json
+import unittest
+from unittest import mock
+from deck_box import fsck as fsck_module
+from deck_box.fsck import DeckChecker, iter_salvaged_records
+from deck_box.models import Card, DivinationResult
+from deck_box.storage import Storage
+from helpers import StorageTestCase
+
+class TestSalvage(unittest.TestCase):
+    def test_damaged_records_are_skipped(self):
+        """Test readable records around damaged ones are recovered, even across small reads"""
+        text = (
+            '{"version": 3, "cards": [\n'
+            '{"id": "1", "name": "一"},\n'
+            '{"id": "2", "na\n'
+            '{"id": "3", "name": "三 {x}"},\n'
+            'garbage ] here\n'
+            '{"id": "4", "name": "四"}\n'
+            ']}\n'
+        )
+        with mock.patch.object(fsck_module, "READ_CHUNK_SIZE", 5):
+            records = list(iter_salvaged_records(io.StringIO(text)))
+
+        self.assertEqual(records, [{"id": "1", "name": "一"}, None, {"id": "3", "name": "三 {x}"}, None, {"id": "4", "name": "四"}])
+
+    def test_nested_objects_of_damaged_records_are_skipped(self):
+        """Test reading resumes at the next record, not at an object nested in the damaged one"""
+        text = (
+            '[\n'
+            '  {\n    "id": "1",\n    "cards": [\n      {"id": "a"}\n    ]\n  },\n'
+            '  {\n    "id": 2 oops,\n    "cards": [\n      {"id": "b"}\n    ]\n  },\n'
+            '  {\n    "id": "3",\n    "cards": []\n  }\n'
+            ']\n'
+        )
+        with mock.patch.object(fsck_module, "READ_CHUNK_SIZE", 4):
+            records = list(iter_salvaged_records(io.StringIO(text)))
+
+        self.assertEqual([record and record["id"] for record in records], ["1", None, "3"])
+
+    def test_truncated_file(self):
+        """Test a file cut off in the middle of a record"""
+        records = list(iter_salvaged_records(io.StringIO('{"version": 3, "cards": [\n{"id": "1"},\n{"id": "2", "name')))
+        self.assertEqual(records, [{"id": "1"}, None])
+
+class TestDeckChecker(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = Storage()
+
+    def test_clean_deck(self):
+        """Test a healthy deck reports no problems"""
+        first = Card("第一步", 10)
+        self.storage.save_cards([first, Card("第二步", 20, predecessor_id=first.id)])
+
+        report = DeckChecker("default").check()
+
+        self.assertTrue(report.clean)
+        self.assertEqual(report.cards, 2)
+
+    def test_problems_are_found_and_repaired(self):
+        """Test damaged records, duplicates, dangling and cyclic predecessors and wrong levels are repaired"""
+        a = Card("甲", 10)
+        b = Card("乙", 20, predecessor_id=a.id)
+        a.predecessor_id = b.id
+        c = Card("丙", 30, predecessor_id=a.id)
+        dangling = Card("丁", 30, predecessor_id="missing")
+        wrong_level = Card("戊", 90)
+        wrong_level.level = 1
+        self.storage.save_cards([a, b, c, dangling, wrong_level, wrong_level])
+        # The last record was cut off in the middle of a write
+        with open(self.storage.cards_file, encoding="utf-8") as f:
+            text = f.read()
+        text = text[:text.rindex("]")]
+        with open(self.storage.cards_file, "w", encoding="utf-8") as f:
+            f.write(text + ',\n{"id": "cut off", "na')
+        with open(self.storage.journal_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"op": "delete", "id": c.id}) + "\n")
+
+        report = DeckChecker("default").check()
+
+        self.assertEqual(report.cards, 4)
+        self.assertEqual(report.damaged["cards.json"], 1)
+        self.assertEqual(set(report.examples["cycle"]), {a.id, b.id})
+        self.assertEqual(report.examples["dangling"], [dangling.id])
+        self.assertEqual(report.examples["duplicate"], [wrong_level.id])
+        self.assertEqual(report.examples["level"], [wrong_level.id])
+        self.assertFalse(report.repaired)
+
+        self.assertTrue(DeckChecker("default").check(repair=True).repaired)
+        self.assertTrue(DeckChecker("default").check().clean)
+
+        cards = {card.name: card for card in Storage().load_cards()}
+        self.assertEqual(sorted(cards), ["丁", "乙", "戊", "甲"])
+        self.assertIsNone(cards["丁"].predecessor_id)
+        self.assertEqual(cards["戊"].level, 4)
+        # The cycle is broken at exactly one card
+        self.assertEqual(sum(cards[name].predecessor_id is None for name in ("甲", "乙")), 1)
+
+    def test_damaged_divination_is_dropped(self):
+        """Test the card snapshots of a damaged divination result are not taken for results"""
+        first = DivinationResult([Card("第一次", 10), Card("第二张", 20)])
+        second = DivinationResult([Card("第二次", 30)])
+        self.storage.save_divination(first)
+        self.storage.save_divination(second)
+        with open(self.storage.divination_file, encoding="utf-8") as f:
+            text = f.read()
+        # Damage the first result before its card snapshots
+        with open(self.storage.divination_file, "w", encoding="utf-8") as f:
+            f.write(text.replace(f'"id": "{first.id}"', '"id": "', 1))
+
+        report = DeckChecker("default").check(repair=True)
+
+        self.assertEqual(report.damaged["divination.json"], 1)
+        self.assertEqual([d.id for d in Storage().load_divinations()], [second.id])
+
+    def test_archived_predecessor_is_not_dangling(self):
+        """Test predecessors that were archived still count as existing"""
+        with open(self.storage.archive_ids_file, "w", encoding="utf-8") as f:
+            f.write("archived-id\n")
+        self.storage.save_cards([Card("后续", 10, predecessor_id="archived-id")])
+
+        self.assertTrue(DeckChecker("default").check().clean)
+
+if __name__ == '__main__':
+    unittest.main()
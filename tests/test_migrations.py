@@ -0,0 +1,99 @@
+import io
+import json
+import os
+import unittest
+from pathlib import Path
+from unittest import mock
+from deck_box import migrations
+from deck_box.migrations import SCHEMA_VERSION, iter_json_array, migrate_array_file, read_version, upgrade_card
+from deck_box.models import CardStatus
+from deck_box.storage import Storage
+from helpers import StorageTestCase
+
+# A card as written before versioning, with some fields missing
+LEGACY_CARD = {
+    "id": "legacy-1",
+    "name": "旧卡片",
+    "estimated_time": 45,
+    "status": "completed",
+    "created_at": "2023-01-01T10:00:00",
+    "completed_at": "2023-01-01T10:40:00",
+    "mood": "good",
+    "quality": "good"
+}
+
+class TestMigrations(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        archive_days = mock.patch.dict(os.environ, {"DECK_BOX_ARCHIVE_DAYS": "100000"})
+        archive_days.start()
+        self.addCleanup(archive_days.stop)
+        self.path = Path(self.tmp_dir.name) / "cards.json"
+
+    def write_legacy_cards(self, count):
+        cards = [dict(LEGACY_CARD, id=f"legacy-{i}") for i in range(count)]
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(cards, f, ensure_ascii=False, indent=2)
+
+    def test_iter_json_array_streams_in_small_chunks(self):
+        """Test records are parsed correctly even when they span many reads"""
+        records = [{"id": str(i), "name": "卡片 [x], {y}"} for i in range(20)]
+        with mock.patch.object(migrations, "READ_CHUNK_SIZE", 7):
+            parsed = list(iter_json_array(io.StringIO(json.dumps({"version": 2, "cards": records}, indent=2))))
+        self.assertEqual(parsed, records)
+
+    def test_legacy_deck_is_upgraded(self):
+        """Test a legacy deck is migrated and stamped when opened"""
+        self.write_legacy_cards(3)
+
+        cards = Storage().load_cards()
+
+        self.assertEqual(read_version(self.path), SCHEMA_VERSION)
+        self.assertEqual(len(cards), 3)
+        self.assertEqual(cards[0].level, 3)
+        self.assertIsNone(cards[0].predecessor_id)
+        self.assertEqual(cards[0].status, CardStatus.COMPLETED)
+        self.assertIsNone(cards[0].due_at)
+        self.assertIsNone(cards[0].priority)
+        self.assertEqual(read_version(Path(self.tmp_dir.name) / "divination.json"), SCHEMA_VERSION)
+
+    def test_migration_is_idempotent(self):
+        """Test migrating a current file does nothing and upgrade steps can be repeated"""
+        self.write_legacy_cards(2)
+        self.assertTrue(migrate_array_file(self.path, "cards", upgrade_card))
+        content = self.path.read_bytes()
+
+        self.assertFalse(migrate_array_file(self.path, "cards", upgrade_card))
+        self.assertEqual(self.path.read_bytes(), content)
+        card = upgrade_card(dict(LEGACY_CARD), 1)
+        self.assertEqual(upgrade_card(dict(card), 1), card)
+
+    def test_interrupted_migration_resumes(self):
+        """Test a migration interrupted halfway continues where it stopped"""
+        self.write_legacy_cards(10)
+        upgraded = []
+
+        def failing_upgrade(data, version):
+            if len(upgraded) == 6:
+                raise KeyboardInterrupt
+            upgraded.append(data["id"])
+            return upgrade_card(data, version)
+
+        with self.assertRaises(KeyboardInterrupt):
+            migrate_array_file(self.path, "cards", failing_upgrade)
+        self.assertEqual(read_version(self.path), 1)
+
+        resumed = []
+
+        def counting_upgrade(data, version):
+            resumed.append(data["id"])
+            return upgrade_card(data, version)
+
+        self.assertTrue(migrate_array_file(self.path, "cards", counting_upgrade))
+        self.assertEqual(resumed, [f"legacy-{i}" for i in range(6, 10)])
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.assertEqual([card["id"] for card in data["cards"]], [f"legacy-{i}" for i in range(10)])
+
+if __name__ == '__main__':
+    unittest.main()
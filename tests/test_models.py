@@ -1,6 +1,6 @@
 import unittest
 from datetime import datetime
-from deck_box.models import Card, CardStatus, Mood, Quality
+from deck_box.models import Card, CardStatus, Frequency, Mood, Quality, Template
 
 class TestCardModel(unittest.TestCase):
     def test_card_creation(self):
@@ -86,5 +86,33 @@ class TestCardModel(unittest.TestCase):
         self.assertEqual(card.mood, Mood.GOOD)
         self.assertEqual(card.quality, Quality.EXCELLENT)
 
+class TestTemplateModel(unittest.TestCase):
+    def test_weekly_occurrences(self):
+        """Test the occurrence of a moment and the due date of its card"""
+        template = Template("周报", 30, Frequency.WEEKLY, 2, start_at=datetime(2024, 1, 1, 9, 0))
+        
+        self.assertIsNone(template.occurrence_at(datetime(2023, 12, 31)))
+        self.assertEqual(template.occurrence_at(datetime(2024, 1, 1, 9, 0)), 0)
+        self.assertEqual(template.occurrence_at(datetime(2024, 1, 15, 8, 59)), 0)
+        self.assertEqual(template.occurrence_at(datetime(2024, 1, 15, 9, 0)), 1)
+        self.assertEqual(template.instance(1).due_at, datetime(2024, 1, 29, 9, 0))
+    
+    def test_monthly_occurrences_clamp_day(self):
+        """Test monthly schedules starting late in the month"""
+        template = Template("交房租", 10, Frequency.MONTHLY, start_at=datetime(2024, 1, 31))
+        
+        self.assertEqual(template.occurrence_start(1), datetime(2024, 2, 29))
+        self.assertEqual(template.occurrence_start(2), datetime(2024, 3, 31))
+        self.assertEqual(template.occurrence_at(datetime(2024, 2, 28)), 0)
+        self.assertEqual(template.occurrence_at(datetime(2024, 12, 31)), 11)
+    
+    def test_instance_ids_are_deterministic(self):
+        """Test every occurrence always creates a card with the same ID"""
+        template = Template("浇花", 5)
+        copy = Template.from_dict(template.to_dict())
+        
+        self.assertEqual(template.instance(3).id, copy.instance(3).id)
+        self.assertNotEqual(template.instance(3).id, template.instance(4).id)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,62 @@
+import unittest
+from unittest import mock
+from deck_box.models import Card
+from deck_box.search import tokenize, tokenize_query
+from deck_box.storage import Storage
+from helpers import StorageTestCase
+
+class TestTokenize(unittest.TestCase):
+    def test_cjk_bigrams(self):
+        """Test CJK text is split into characters and bigrams"""
+        self.assertEqual(tokenize("项目文档"), ["项", "目", "文", "档", "项目", "目文", "文档"])
+
+    def test_mixed_text(self):
+        """Test words are lowercased and separated from CJK text"""
+        self.assertEqual(tokenize("Write周报 v2"), ["write", "周", "报", "周报", "v2"])
+
+    def test_query_terms(self):
+        """Test query words match as prefixes and CJK text by bigrams"""
+        self.assertEqual(tokenize_query("项目文 rep"), [("项目", False), ("目文", False), ("rep", True)])
+
+class TestSearchIndex(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = Storage()
+        self.doc = Card("完成项目文档", 30, "work", "编写技术文档")
+        self.report = Card("Write weekly report", 20, "work")
+        self.storage.save_cards([self.doc, self.report, Card("打扫厨房", 15, "home")])
+
+    def search(self, query):
+        return sorted(card.name for card in self.storage.search_cards(query))
+
+    def test_search(self):
+        """Test searching names, descriptions and tags"""
+        self.assertEqual(self.search("项目"), ["完成项目文档"])
+        self.assertEqual(self.search("技术"), ["完成项目文档"])
+        self.assertEqual(self.search("work"), ["Write weekly report", "完成项目文档"])
+        self.assertEqual(self.search("week rep"), ["Write weekly report"])
+        self.assertEqual(self.search("厨房 work"), [])
+
+    def test_index_is_maintained_incrementally(self):
+        """Test adding, modifying and deleting cards updates the index"""
+        self.search("work")
+        with mock.patch.object(Storage, "load_cards", side_effect=AssertionError):
+            self.storage.add_card(Card("整理项目周报", 10, "work"))
+            self.doc.name = "修改后的标题"
+            self.storage.update_card(self.doc)
+            self.storage.delete_card(self.report.id)
+
+            self.assertEqual(self.search("项目"), ["整理项目周报"])
+            self.assertEqual(self.search("标题"), ["修改后的标题"])
+            self.assertEqual(self.search("文档"), ["修改后的标题"])
+            self.assertEqual(self.search("weekly"), [])
+
+    def test_resolve_card_id(self):
+        """Test resolving unique and ambiguous ID prefixes"""
+        self.assertEqual(self.storage.resolve_card_id(self.doc.id[:8]), [self.doc.id])
+        self.assertEqual(self.storage.resolve_card_id(self.doc.id), [self.doc.id])
+        self.assertEqual(self.storage.resolve_card_id("not-an-id"), [])
+        self.assertEqual(len(self.storage.resolve_card_id("")), 0)
+
+if __name__ == '__main__':
+    unittest.main()
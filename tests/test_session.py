@@ -0,0 +1,63 @@
+import unittest
+from deck_box.divination import AvailabilityIndex
+from deck_box.models import Card, CardStatus, Mood, Quality
+from deck_box.session import Session
+from deck_box.storage import Storage
+from helpers import StorageTestCase
+
+class TestAvailabilityIndex(unittest.TestCase):
+    def test_completing_unlocks_dependents(self):
+        """Test completing a card makes the cards depending on it available"""
+        first = Card("第一步", 10)
+        second = Card("第二步", 10, predecessor_id=first.id)
+        index = AvailabilityIndex([first, second])
+        self.assertEqual(index.available_cards(), [first])
+
+        first.complete(Mood.GOOD, 10, Quality.GOOD)
+        changed = index.update(first)
+
+        self.assertEqual(changed, [first, second])
+        self.assertEqual(index.available_cards(), [second])
+
+    def test_archived_predecessor(self):
+        """Test a card whose predecessor was archived is available"""
+        card = Card("后续", 10, predecessor_id="archived-id")
+        index = AvailabilityIndex([card], is_archived=lambda card_id: card_id == "archived-id")
+        self.assertEqual(index.available_cards(), [card])
+
+class TestSession(StorageTestCase):
+
+    def test_session_changes_are_persisted(self):
+        """Test completions made in a session are written to storage when it closes"""
+        first = Card("第一步", 30)
+        second = Card("第二步", 20, predecessor_id=first.id)
+        Storage().save_cards([first, second])
+
+        session = Session()
+        drawn = session.draw(single=True)
+        self.assertEqual([card.id for card in drawn], [first.id])
+        unlocked = session.complete(session.find_card("#1"), Mood.AWESOME, 25)
+        self.assertEqual([card.id for card in unlocked], [second.id])
+        self.assertIs(session.find_card(second.id[:8]), session.index.cards[second.id])
+        session.close()
+
+        self.assertEqual(session.writer.errors, [])
+        storage = Storage()
+        self.assertEqual(storage.get_card_by_id(first.id).status, CardStatus.COMPLETED)
+        self.assertEqual(storage.get_card_by_id(first.id).actual_time, 25)
+        self.assertEqual(len(storage.load_divinations()), 1)
+
+    def test_urgent_draw_follows_completions(self):
+        """Test urgent draws come from the ready queue kept up to date by completions"""
+        first = Card("准备材料", 20, priority=5)
+        urgent = Card("提交申请", 30, predecessor_id=first.id, priority=5)
+        Storage().save_cards([first, urgent, Card("浇花", 5)])
+
+        session = Session()
+        self.assertEqual([card.id for card in session.draw(single=True, urgent=True)], [first.id])
+        session.complete(session.find_card("#1"))
+        self.assertEqual([card.id for card in session.draw(30, 40, urgent=True)], [urgent.id])
+        session.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import unittest
+from deck_box.models import Card
+from deck_box.simulation import simulate
+
+class TestSimulation(unittest.TestCase):
+    def setUp(self):
+        self.cards = [Card(f"任务{minutes}", minutes, "work") for minutes in (5, 10, 20, 30, 45, 60, 90)]
+
+    def run_simulation(self, workers):
+        return list(simulate(self.cards, runs=600, workers=workers, min_time=60, max_time=120, seed=7))[-1]
+
+    def test_histograms(self):
+        """Test every run is counted in the histograms"""
+        result = self.run_simulation(workers=1)
+
+        self.assertEqual(result.runs, 600)
+        self.assertEqual(sum(result.card_counts.values()), result.runs - result.failures)
+        self.assertEqual(sum(result.levels.values()), sum(n * count for n, count in result.card_counts.items()))
+        self.assertGreater(result.in_range, 0)
+
+    def test_result_does_not_depend_on_workers(self):
+        """Test a seeded simulation gives the same histograms with a process pool"""
+        single = self.run_simulation(workers=1)
+        pooled = self.run_simulation(workers=2)
+
+        self.assertEqual(single.total_times, pooled.total_times)
+        self.assertEqual(single.levels, pooled.levels)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+import gzip
+import json
+import multiprocessing
+import threading
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from deck_box.divination import Divination
+from deck_box.models import Card, CardStatus, Frequency, Mood, Quality, Template
+from deck_box import storage as storage_module
+from deck_box.migrations import SCHEMA_VERSION
+from deck_box.storage import DEFAULT_DECK, Storage
+from helpers import StorageTestCase
+
+class TestDecks(StorageTestCase):
+    def test_decks_are_stored_separately(self):
+        """Test each deck is stored in its own shard"""
+        work = Storage("work")
+        home = Storage("home")
+        work.add_card(Card("写周报", 30, "work"))
+
+        self.assertEqual(len(work.load_cards()), 1)
+        self.assertEqual(home.load_cards(), [])
+        self.assertNotEqual(work.cards_file, home.cards_file)
+        self.assertEqual(Storage.list_decks(), [DEFAULT_DECK, "home", "work"])
+
+    def test_default_deck_uses_app_dir(self):
+        """Test the default deck keeps its files directly in DECK_BOX_HOME"""
+        storage = Storage()
+        self.assertEqual(storage.cards_file.parent, storage.app_dir)
+        self.assertEqual(str(storage.app_dir), self.tmp_dir.name)
+
+    def test_invalid_deck_name(self):
+        """Test deck names cannot escape the data directory"""
+        with self.assertRaises(ValueError):
+            Storage("../work")
+        with self.assertRaises(ValueError):
+            Storage("work\n")
+
+    def test_unknown_deck_is_not_created_by_reads(self):
+        """Test opening a deck only to read it does not create it"""
+        with self.assertRaises(ValueError):
+            Storage("nosuch", create=False)
+        with self.assertRaises(ValueError):
+            Divination(decks=["nosuch"])._get_available_cards()
+
+        self.assertFalse(Storage.deck_exists("nosuch"))
+        self.assertEqual(Storage.list_decks(), [DEFAULT_DECK])
+
+    def test_cross_deck_divination(self):
+        """Test drawing from several decks merges their available cards"""
+        work = Storage("work")
+        home = Storage("home")
+        first = Card("整理会议纪要", 20, "work")
+        first.complete(Mood.GOOD, 20, Quality.GOOD)
+        work.add_card(first)
+        work.add_card(Card("回复邮件", 10, "work", predecessor_id=first.id))
+        home.add_card(Card("打扫厨房", 15, "home"))
+
+        divination = Divination("work", decks=["work", "home"])
+        available = {card.name for card in divination._get_available_cards()}
+
+        self.assertEqual(available, {"回复邮件", "打扫厨房"})
+        self.assertEqual({divination.deck_of(card) for card in divination._get_available_cards()}, {"work", "home"})
+
+class TestKeyedUpdates(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = Storage()
+        self.cards = [Card(f"任务{i}", 10 + i) for i in range(5)]
+        self.storage.save_cards(self.cards)
+
+    def test_point_operations_do_not_load_deck(self):
+        """Test single-card reads and writes never load the whole deck"""
+        card = self.cards[2]
+        with mock.patch.object(Storage, "load_cards", side_effect=AssertionError):
+            loaded = self.storage.get_card_by_id(card.id)
+            loaded.complete(Mood.GOOD, 12, Quality.GOOD)
+            self.assertTrue(self.storage.update_card(loaded))
+            self.assertTrue(self.storage.delete_card(self.cards[0].id))
+            self.storage.add_card(Card("新任务", 5))
+            self.assertEqual(self.storage.get_card_by_id(card.id).actual_time, 12)
+
+        cards = Storage().load_cards()
+        self.assertEqual([c.name for c in cards], ["任务1", "任务2", "任务3", "任务4", "新任务"])
+        self.assertEqual(cards[1].status, CardStatus.COMPLETED)
+
+    def test_missing_cards(self):
+        """Test keyed operations on unknown IDs"""
+        self.assertIsNone(self.storage.get_card_by_id("missing"))
+        self.assertFalse(self.storage.update_card(Card("不存在", 10)))
+        self.assertFalse(self.storage.delete_card("missing"))
+
+    def test_journal_compaction(self):
+        """Test the journal is folded into the cards file once it grows too long"""
+        with mock.patch.object(storage_module, "COMPACT_THRESHOLD", 3):
+            for card in self.cards[:3]:
+                card.complete(Mood.GOOD, 10, Quality.GOOD)
+                self.storage.update_card(card)
+
+        self.assertEqual(self.storage.journal_file.stat().st_size, 0)
+        self.assertEqual(self.storage.get_card_by_id(self.cards[0].id).actual_time, 10)
+        self.assertEqual(len(self.storage.load_cards()), 5)
+
+    def test_index_rebuilt_after_external_edit(self):
+        """Test the index is rebuilt when the cards file is rewritten by hand"""
+        card = Card("手动添加", 20)
+        with open(self.storage.cards_file, "w", encoding="utf-8") as f:
+            json.dump({"version": SCHEMA_VERSION, "cards": [card.to_dict()]}, f, indent=2)
+
+        self.assertEqual(self.storage.get_card_by_id(card.id).name, "手动添加")
+        self.assertIsNone(self.storage.get_card_by_id(self.cards[0].id))
+
+def _compact_repeatedly(times):
+    """Compact the default deck over and over, from another process"""
+    storage = Storage()
+    for _ in range(times):
+        storage.compact()
+
+class TestConcurrentProcesses(StorageTestCase):
+    def test_reads_during_compaction_in_another_process(self):
+        """Test point reads keep finding every card while another process rebuilds the index"""
+        storage = Storage()
+        cards = [Card(f"任务{i}", 10 + i) for i in range(200)]
+        storage.save_cards(cards)
+
+        compactor = multiprocessing.get_context("fork").Process(target=_compact_repeatedly, args=(50,))
+        compactor.start()
+        try:
+            missing = 0
+            while compactor.is_alive():
+                for card in cards[::20]:
+                    missing += Storage().get_card_by_id(card.id) is None
+        finally:
+            compactor.join()
+
+        self.assertEqual(compactor.exitcode, 0)
+        self.assertEqual(missing, 0)
+
+class TestArchive(StorageTestCase):
+    def test_old_completed_cards_are_archived(self):
+        """Test old completed cards move to the archive and still count as completed"""
+        storage = Storage(archive_after_days=7)
+        old = Card("旧任务", 10)
+        old.complete(Mood.GOOD, 10, Quality.GOOD)
+        old.completed_at -= timedelta(days=8)
+        recent = Card("新完成的任务", 10)
+        recent.complete(Mood.GOOD, 10, Quality.GOOD)
+        follower = Card("后续任务", 20, predecessor_id=old.id)
+        storage.save_cards([old, recent, follower])
+
+        # Reading the deck never changes it; the next write archives the old card
+        self.assertEqual(len(storage.load_cards()), 3)
+        storage.update_card(follower)
+        cards = storage.load_cards()
+
+        self.assertEqual([c.name for c in cards], ["新完成的任务", "后续任务"])
+        self.assertEqual([c.name for c in storage.iter_archived_cards()], ["旧任务"])
+        self.assertTrue(Storage().is_archived(old.id))
+        self.assertIsNone(storage.get_card_by_id(old.id))
+        self.assertEqual([c.name for c in Divination()._get_available_cards()], ["后续任务"])
+
+        # Archiving again does not duplicate cards
+        storage.compact()
+        self.assertEqual(len(list(storage.iter_archived_cards())), 1)
+
+    def test_interrupted_archival_is_not_duplicated(self):
+        """Test an archival cut off in the middle of a gzip member archives every card exactly once"""
+        storage = Storage(archive_after_days=7)
+        cards = [Card(f"旧任务{i}", 10) for i in range(3)]
+        for card in cards:
+            card.complete(Mood.GOOD, 10, Quality.GOOD)
+            card.completed_at -= timedelta(days=8)
+        storage.save_cards(cards)
+
+        # The first run recorded every ID, appended the first card and died
+        # halfway through the member holding the others
+        with open(storage.archive_ids_file, "w", encoding="utf-8") as f:
+            f.writelines(card.id + "\n" for card in cards)
+        lines = [json.dumps(card.to_dict(), ensure_ascii=False) + "\n" for card in cards]
+        partial = gzip.compress("".join(lines[1:]).encode("utf-8"))
+        with open(storage.archive_file, "wb") as f:
+            f.write(gzip.compress(lines[0].encode("utf-8")))
+            f.write(partial[:len(partial) // 2])
+
+        storage = Storage(archive_after_days=7)
+        self.assertEqual([c.name for c in storage.iter_archived_cards()], ["旧任务0"])
+        storage.compact()
+        storage.compact()
+
+        self.assertEqual(storage.load_cards(), [])
+        self.assertEqual(sorted(c.name for c in storage.iter_archived_cards()), ["旧任务0", "旧任务1", "旧任务2"])
+        self.assertEqual(sorted(storage.archived_ids()), sorted(card.id for card in cards))
+
+    def test_archival_by_another_storage_is_seen(self):
+        """Test a long-lived storage notices cards archived through another one"""
+        storage = Storage(archive_after_days=7)
+        old = Card("旧任务", 10)
+        old.complete(Mood.GOOD, 10, Quality.GOOD)
+        old.completed_at -= timedelta(days=8)
+        storage.save_cards([old])
+        self.assertFalse(storage.is_archived(old.id))
+
+        Storage(archive_after_days=7).compact()
+
+        self.assertTrue(storage.is_archived(old.id))
+
+class TestTemplates(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = Storage()
+        self.template = Template("浇花", 5, Frequency.DAILY, start_at=datetime(2024, 6, 1))
+        self.storage.add_template(self.template)
+
+    def test_materialization_is_lazy_and_idempotent(self):
+        """Test only the current occurrence is created, and only once"""
+        now = datetime(2024, 6, 10, 12, 0)
+        created = self.storage.materialize_templates(now)
+
+        self.assertEqual([card.due_at for card in created], [datetime(2024, 6, 11)])
+        self.assertEqual(self.storage.materialize_templates(now), [])
+        self.assertEqual(len(self.storage.load_cards()), 1)
+
+        # A deleted card is not recreated, the next occurrence is
+        self.storage.delete_card(created[0].id)
+        self.assertEqual(self.storage.materialize_templates(now), [])
+        self.assertEqual(len(self.storage.materialize_templates(now + timedelta(days=1))), 1)
+
+    def test_concurrent_materialization(self):
+        """Test templates expanded by several storages at once create each card once"""
+        now = datetime(2024, 6, 10, 12, 0)
+        created = []
+        threads = [threading.Thread(target=lambda: created.extend(Storage().materialize_templates(now))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(created), 1)
+        self.assertEqual(len(self.storage.load_cards()), 1)
+        self.assertEqual(self.storage.load_templates()[0].last_occurrence, 9)
+
+    def test_divination_materializes_templates(self):
+        """Test a divination draws the current cards of templates"""
+        self.assertEqual([card.name for card in Divination()._get_available_cards()], ["浇花"])
+        self.assertTrue(self.storage.delete_template(self.template.id))
+        self.assertEqual(self.storage.load_templates(), [])
+
+if __name__ == '__main__':
+    unittest.main()